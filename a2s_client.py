@@ -0,0 +1,183 @@
+import asyncio
+import struct
+
+from metrics import A2S_ERRORS, A2S_LATENCY, timed
+
+# Протокол Source A2S: https://developer.valvesoftware.com/wiki/Server_queries
+SINGLE_PACKET = -1
+SPLIT_PACKET = -2
+A2S_INFO = b"\xFF\xFF\xFF\xFFTSource Engine Query\x00"
+A2S_PLAYER = b"\xFF\xFF\xFF\xFFU"
+NO_CHALLENGE = b"\xFF\xFF\xFF\xFF"
+S2C_CHALLENGE = 0x41
+S2A_INFO = 0x49
+S2A_PLAYER = 0x44
+
+DEFAULT_TIMEOUT = 3.0
+DEFAULT_RETRIES = 1
+
+
+class A2SError(Exception):
+    pass
+
+
+class _Reader:
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def byte(self):
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def unpack(self, fmt):
+        values = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return values[0] if len(values) == 1 else values
+
+    def string(self):
+        end = self.data.index(b"\x00", self.pos)
+        value = self.data[self.pos:end].decode("utf-8", errors="replace")
+        self.pos = end + 1
+        return value
+
+
+class _Protocol(asyncio.DatagramProtocol):
+    def __init__(self, client):
+        self.client = client
+
+    def datagram_received(self, data, addr):
+        self.client._on_datagram(data, addr[:2])
+
+    def error_received(self, exc):
+        # ICMP "port unreachable" и т.п. — ответа не будет, ждущие упадут по таймауту
+        pass
+
+
+class A2SClient:
+    """Асинхронный клиент A2S_INFO / A2S_PLAYER без потоков.
+
+    Все запросы идут через один UDP-сокет; ответы раскладываются по адресу
+    сервера. Для одного сервера одновременно идёт не больше одного обмена,
+    разные серверы опрашиваются параллельно.
+    """
+
+    def __init__(self, timeout=DEFAULT_TIMEOUT, retries=DEFAULT_RETRIES):
+        self.timeout = timeout
+        self.retries = retries
+        self._transport = None
+        self._waiters = {}  # addr -> asyncio.Future с очередным пакетом
+        self._splits = {}  # (addr, id пакета) -> {номер: кусок}
+        self._locks = {}  # addr -> asyncio.Lock
+
+    async def start(self):
+        if self._transport is None:
+            loop = asyncio.get_running_loop()
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _Protocol(self), local_addr=("0.0.0.0", 0)
+            )
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+
+    @timed(A2S_LATENCY, A2S_ERRORS)
+    async def info(self, address):
+        """{'name', 'map', 'players', 'max_players', 'bots'}"""
+        data = await self._query(address, A2S_INFO, S2A_INFO, append_challenge=True)
+        r = _Reader(data)
+        r.byte()  # версия протокола
+        name, map_name = r.string(), r.string()
+        r.string()  # папка игры
+        r.string()  # название игры
+        r.unpack("<h")  # steam app id
+        players, max_players, bots = r.byte(), r.byte(), r.byte()
+        return {
+            "name": name,
+            "map": map_name,
+            "players": players,
+            "max_players": max_players,
+            "bots": bots,
+        }
+
+    @timed(A2S_LATENCY, A2S_ERRORS)
+    async def players(self, address):
+        """[{'name', 'score', 'duration'}]"""
+        data = await self._query(address, A2S_PLAYER + NO_CHALLENGE, S2A_PLAYER, append_challenge=False)
+        r = _Reader(data)
+        result = []
+        for _ in range(r.byte()):
+            r.byte()  # индекс
+            name = r.string()
+            score, duration = r.unpack("<lf")
+            result.append({"name": name, "score": score, "duration": duration})
+        return result
+
+    async def _query(self, address, request, expected, append_challenge):
+        await self.start()
+        addr = (address[0], int(address[1]))
+        lock = self._locks.setdefault(addr, asyncio.Lock())
+        async with lock:
+            last_error = None
+            for _ in range(self.retries + 1):
+                try:
+                    return await self._exchange(addr, request, expected, append_challenge)
+                except asyncio.TimeoutError:
+                    last_error = A2SError(f"timeout {addr[0]}:{addr[1]}")
+            raise last_error
+
+    async def _exchange(self, addr, request, expected, append_challenge):
+        payload = request
+        # Сервер может потребовать challenge — тогда повторяем запрос с ним
+        for _ in range(3):
+            response = await self._request(addr, payload)
+            kind, body = response[0], response[1:]
+            if kind == S2C_CHALLENGE:
+                challenge = body[:4]
+                payload = request + challenge if append_challenge else request[:-4] + challenge
+                continue
+            if kind != expected:
+                raise A2SError(f"unexpected response 0x{kind:02x} from {addr[0]}:{addr[1]}")
+            return body
+        raise A2SError(f"too many challenges from {addr[0]}:{addr[1]}")
+
+    async def _request(self, addr, payload):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters[addr] = future
+        try:
+            self._transport.sendto(payload, addr)
+            return await asyncio.wait_for(future, self.timeout)
+        finally:
+            if self._waiters.get(addr) is future:
+                del self._waiters[addr]
+            self._splits = {k: v for k, v in self._splits.items() if k[0] != addr}
+
+    def _on_datagram(self, data, addr):
+        future = self._waiters.get(addr)
+        if future is None or future.done() or len(data) < 5:
+            return
+        header = struct.unpack_from("<l", data)[0]
+        if header == SINGLE_PACKET:
+            future.set_result(data[4:])
+        elif header == SPLIT_PACKET:
+            payload = self._assemble(data, addr)
+            if payload is not None:
+                future.set_result(payload[4:])
+
+    def _assemble(self, data, addr):
+        # Формат Source: id (long), всего (byte), номер (byte), размер (short), данные
+        if len(data) < 12:
+            return None
+        packet_id, total, number = struct.unpack_from("<lBB", data, 4)
+        if packet_id & 0x80000000:
+            # Сжатые bz2 ответы шлют только очень старые движки
+            self._waiters[addr].set_exception(A2SError("compressed A2S responses are not supported"))
+            return None
+        parts = self._splits.setdefault((addr, packet_id), {})
+        parts[number] = data[12:]
+        if len(parts) < total:
+            return None
+        del self._splits[(addr, packet_id)]
+        return b"".join(parts[i] for i in range(total))
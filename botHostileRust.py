@@ -1,14 +1,15 @@
-import a2s
-import aiosqlite
 from aiogram.types import InlineKeyboardButton
 import asyncio
-import json
 import logging
-import random
-from datetime import datetime, timedelta
+import multiprocessing
+from html import escape
+import signal
+import time
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
 from aiogram import Bot, Dispatcher, F
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery
 from aiogram.filters import Command
 from aiogram.fsm.state import StatesGroup, State
@@ -16,106 +17,141 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 import pytz
+from a2s_client import A2SClient
+from broadcast import STATUS_TEXT, BroadcastJobs, Broadcaster
+from cooldown import Cooldown, format_wait
 from database import Database
+from fsm_storage import SQLiteStorage
+from keyboards import (
+    ADMIN_BACK_KB, ADMIN_KB, BACK_KB, BC_CONFIRM_KB, CB, INFO_TEXT, IPS_TEXT, MAIN_KB,
+    delpromo_confirm_kb, ips_kb, link_raid_text, main_text, ticket_admin_kb, ticket_release_kb,
+    ticket_reply_kb,
+)
+from logs import setup_logging
+from media import MediaCache
+from metrics import MetricsServer
+from middlewares import ActivityMiddleware, MetricsMiddleware, TelegramMetricsMiddleware, ThrottlingMiddleware
+from online_history import DAILY_DAYS, HOURLY_DAYS, RAW_DAYS, online_report
+from paging import NOOP, PAGE_SIZE, PREFIX, page_count, pager_row, parse_pager
+from raid import RaidConfig, RaidNotifier
+from server_status import POLL_INTERVAL, StatusCache, format_age
+from servers import ServerRegistry
+from stats import stats_report
+from storage import json_store
+from webhook import WebhookConfig, WebhookServer
+from workers import LEASE_RENEW, Leader, Supervisor, consume
 
 db = Database()
+a2s_client = A2SClient(timeout=2, retries=1)
 
 # ================= CONFIG =================
 
 import os
 
 TOKEN = os.getenv("BOTIK_TOKEN")
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling | webhook (см. webhook.py)
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))  # >1 — несколько процессов-воркеров (см. workers.py)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — /metrics выключен; воркеры берут порт +1, +2...
 ADMIN_IDS = [411379361]  # Список админов
 CHAT_ID = -1001234567890
 
 DATA_DIR = Path("data")
 DATA_PROMO = DATA_DIR / "promocodes.json"
 LOG_FILE = DATA_DIR / "bot.log"
+SERVERS_CONFIG = Path(os.getenv("SERVERS_CONFIG", DATA_DIR / "servers.json"))
 DATA_TICKETS = DATA_DIR / "tickets.json"
 TICKET_COOLDOWN_MINUTES = 10
+PROMO_COOLDOWN_HOURS = 24
 PROMO_EXPIRATION_DAYS = 30  # Срок действия промокодов
+WELCOME_PHOTO = DATA_DIR / "welcome.png"  # Картинка /start; пока файла нет — берём её по ссылке
+WELCOME_PHOTO_URL = "https://i.postimg.cc/4NjwLkNY/IMG-3850.png"
 
 tz = pytz.timezone("Europe/Moscow")
+UTC_OFFSET = 3 * 3600  # МСК без перехода на летнее время, для деления истории онлайна на сутки
 
 # ================= LOGGING =================
 
 DATA_DIR.mkdir(exist_ok=True)
+LOG_JSON = os.getenv("LOG_JSON") == "1"  # JSON-строки с user_id/handler/latency вместо текста
 
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s | %(levelname)s | %(message)s",
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
-)
+# Обработчики ставит setup_logging в __main__ / worker_process: запись на диск
+# идёт в фоновом потоке, воркеры шлют записи супервизору через общую очередь
 log = logging.getLogger("bot")
 
+registry = ServerRegistry.load(SERVERS_CONFIG)
+IPS_KB = ips_kb(registry)
+
 # ================= UTILS =================
 
-def load(path, default):
-    if not path.exists():
-        save(path, default)
-        return default
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except:
-        return default
-
-def save(path, data):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
-
-def remove_expired_promos():
-    """Автоматическое удаление промокодов старше PROMO_EXPIRATION_DAYS"""
-    promos = load(DATA_PROMO, [])
-    now = datetime.now()
-    new_promos = []
+async def import_legacy_promos():
+    """Разовый перенос промокодов из data/promocodes.json в БД"""
+    if not DATA_PROMO.exists():
+        return
+    promos = json_store(DATA_PROMO, []).get()
+    imported = 0
     for promo in promos:
         if isinstance(promo, dict):
-            created = datetime.fromisoformat(promo.get("date"))
-            if (now - created).days < PROMO_EXPIRATION_DAYS:
-                new_promos.append(promo)
+            code = promo["code"]
+            created = datetime.fromisoformat(promo["date"]) if promo.get("date") else None
         else:
-            new_promos.append(promo)
-    save(DATA_PROMO, new_promos)
-    
-async def get_server_status(ip: str, port: int):
-    loop = asyncio.get_running_loop()
+            code, created = promo, None
+        if await db.add_promo(code, PROMO_EXPIRATION_DAYS, created):
+            imported += 1
+    # Переименовываем, чтобы при следующем запуске не импортировать повторно.
+    # Битый файл json_store уже отложил в *.broken-<ts> — переименовывать нечего
+    if DATA_PROMO.exists():
+        DATA_PROMO.rename(DATA_PROMO.with_suffix(".json.imported"))
+    log.info(f"PROMO IMPORT -> {imported} codes from {DATA_PROMO}")
+
+def days_left(expires_at):
+    expires = datetime.fromisoformat(expires_at).replace(tzinfo=timezone.utc)
+    return max((expires - datetime.now(timezone.utc)).days, 0)
 
+async def get_server_status(ip: str, port: int):
     try:
-        info = await loop.run_in_executor(
-            None,
-            lambda: a2s.info((ip, port), timeout=3)
-        )
+        info = await a2s_client.info((ip, port))
 
         return {
             "online": True,
-            "players": info.player_count,
-            "max": info.max_players
+            "players": info["players"],
+            "max": info["max_players"]
         }
 
     except Exception as e:
         log.error(f"A2S error {ip}:{port} -> {e}")
         return {"online": False}
 
+status_cache = StatusCache(get_server_status)
 
-        
-def schedule():
-    wipe = next_wipe()
+async def server_statuses():
+    """[(server, status, возраст)] по всем серверам реестра одним параллельным запросом"""
+    results = await asyncio.gather(*(status_cache.get(*s.query_address) for s in registry))
+    return [(server, status, age) for server, (status, age) in zip(registry, results)]
 
-    scheduler.add_job(
-        wipe_notify,
-        "date",
-        run_date=wipe
-    )
+def schedule():
+    # Серверы с одинаковым временем вайпа оповещаются одной рассылкой.
+    # id задач по времени вайпа: повторный вызов не плодит дубликаты
+    for wipe, wiped in registry.next_wipes(tz).items():
+        names = [s.name for s in wiped]
+
+        scheduler.add_job(
+            leader.only(wipe_notify),
+            "date",
+            run_date=wipe,
+            args=[names],
+            id=f"wipe_notify_{wipe.isoformat()}",
+            replace_existing=True
+        )
 
-    scheduler.add_job(
-        wipe_warning,
-        "date",
-        run_date=wipe - timedelta(hours=1)
-    )
+        scheduler.add_job(
+            leader.only(wipe_warning),
+            "date",
+            run_date=wipe - timedelta(hours=1),
+            args=[names],
+            id=f"wipe_warning_{wipe.isoformat()}",
+            replace_existing=True
+        )
 # ================= FSM =================
 
 class AdminFSM(StatesGroup):
@@ -124,107 +160,83 @@ class AdminFSM(StatesGroup):
     broadcast = State()
     broadcast_confirm = State()
     ticket_answer = State()
+    search = State()
 
 class TicketFSM(StatesGroup):
     waiting_question = State()
+    waiting_reply = State()
 # ================= BOT =================
 
 bot = Bot(TOKEN)
-dp = Dispatcher()
+fsm_storage = SQLiteStorage(db)
+dp = Dispatcher(storage=fsm_storage)
+bot.session.middleware(TelegramMetricsMiddleware())
+throttling = ThrottlingMiddleware(exempt=ADMIN_IDS)
+# Метрики раньше анти-флуда, чтобы видеть и отброшенные апдейты
+for observer in (dp.message, dp.callback_query):
+    observer.middleware(MetricsMiddleware())
+    observer.middleware(ActivityMiddleware(db))
+    observer.middleware(throttling)
 scheduler = AsyncIOScheduler()
-
-# ================= KEYBOARDS =================
-def main_text(first_name="Игрок"):
-    return (
-        f"🔥 *Приветствуем тебя, {first_name}!*\n\n"
-        "📢 Ты попал в информационного бота серверов *Hostile Rust*!\n"
-        "⬇️ Выбери действие ниже ⬇️"
-    )
-
-def main_kb():
-    kb = InlineKeyboardBuilder()
-    kb.button(text="🎁 Получить промокод", callback_data="promo")
-    kb.button(text="📜 Моя история промокодов", callback_data="history")
-    kb.button(text="🛒 Пополнить баланс", url="http://hostilerust.gamestores.app/")
-    kb.button(text="❓ Информация", callback_data="info")
-    kb.button(text="🎮 Онлайн серверов", callback_data="servers")
-    kb.button(text="⏳ До вайпа", callback_data="wipe")
-    kb.button(text="🔗 Оповещения о рейде", callback_data="link_raid")
-    kb.button(text="📝 Задать вопрос", callback_data="ask_question")
-    kb.button(text="📋 IP серверов", callback_data="ips")
-    kb.adjust(2)
-    return kb.as_markup()
-
-def admin_kb():
-    kb = InlineKeyboardBuilder()
-    kb.button(text="➕ Добавить промо", callback_data="a_add")
-    kb.button(text="➖ Удалить промо", callback_data="a_del")
-    kb.button(text="📋 Список промокодов", callback_data="a_list")
-    kb.button(text="👥 Список пользователей", callback_data="a_users")
-    kb.button(text="📊 Статистика", callback_data="a_stats")
-    kb.button(text="📩 Все вопросы", callback_data="a_tickets")
-    kb.button(text="📢 Рассылка", callback_data="a_bc")
-    kb.button(text="⬅ Назад в меню", callback_data="admin_exit")
-    kb.adjust(2)
-    return kb.as_markup()
+promo_cooldown = Cooldown(timedelta(hours=PROMO_COOLDOWN_HOURS), db.get_last_promo)
+ticket_cooldown = Cooldown(timedelta(minutes=TICKET_COOLDOWN_MINUTES), db.get_last_ticket)
+broadcaster = Broadcaster(bot, db)
+media = MediaCache(bot, db)
+leader = Leader(db, enabled=BOT_WORKERS > 1)
+metrics_server = None
+broadcasts = BroadcastJobs(bot, db, broadcaster, leader)
+raid = RaidNotifier(bot, db, RaidConfig.from_env())
 
 # ================= USER =================
-def back_kb():
-    kb = InlineKeyboardBuilder()
-    kb.button(text="⬅️ Назад", callback_data="back_main")
-    kb.adjust(1)
-    return kb.as_markup()
 
 @dp.message(Command("start"))
 async def start(m: Message):
-    # Добавляем пользователя в БД
+    # Добавляем пользователя в БД (write-behind: ответ не ждёт транзакции)
     await db.add_user(m.from_user.id, m.from_user.username or "", m.from_user.first_name or "")
     log.info(f"🎉 NEW USER SUBSCRIBED {m.from_user.id}")
 
-    welcome_text = (
-        f"🔥 *Приветствуем тебя, {m.from_user.first_name or 'Игрок'}!*\n\n"
-        "📢 Ты попал в информационного бота серверов *Hostile Rust*!\n"
-        "⬇️ Выбери действие ниже ⬇️"
-    )
-    photo_url = "https://i.postimg.cc/4NjwLkNY/IMG-3850.png"  # ссылка на фото
-
-    await bot.send_photo(
-        chat_id=m.chat.id,
-        photo=photo_url,
-        caption=welcome_text,
+    # Картинка загружается в Telegram один раз, дальше уходит по file_id
+    await media.send(
+        "photo",
+        m.chat.id,
+        WELCOME_PHOTO,
+        fallback_url=WELCOME_PHOTO_URL,
+        caption=main_text(m.from_user.first_name or "Игрок"),
         parse_mode="Markdown",
-        reply_markup=main_kb()
+        reply_markup=MAIN_KB
     )
 
-@dp.callback_query(F.data == "back_main")
+@dp.callback_query(F.data == CB.BACK_MAIN)
 async def back_main(cb: CallbackQuery):
     await cb.answer()
 
     await cb.message.edit_caption(
         caption=main_text(cb.from_user.first_name or "Игрок"),
-        reply_markup=main_kb(),
+        reply_markup=MAIN_KB,
         parse_mode="Markdown"
     )
     
-@dp.callback_query(F.data == "promo")
+@dp.callback_query(F.data == CB.PROMO)
 async def promo(cb: CallbackQuery):
     """Выдача уникального промокода пользователю и сохранение истории в БД"""
-    # Проверяем последний выданный промокод
-    last = await db.get_last_promo(cb.from_user.id)
-    if last:
-        last_dt = datetime.fromisoformat(last)
-        if datetime.now() - last_dt < timedelta(hours=24):
-            return await cb.message.answer("⏳ Вы уже получали промокод сегодня.")
-
-    # Удаляем просроченные промокоды из JSON
-    remove_expired_promos()
-    promos = load(DATA_PROMO, [])
-    if not promos:
+    # Проверяем кулдаун (из памяти, в БД только при первом обращении) и сразу занимаем его
+    wait = await promo_cooldown.acquire(cb.from_user.id)
+    if wait:
+        return await cb.message.answer(
+            f"⏳ Вы уже получали промокод сегодня. Попробуйте через {format_wait(wait)}."
+        )
+
+    # Забираем случайный свободный промокод из пула (атомарно, без дублей)
+    code = await db.claim_promo(cb.from_user.id)
+    if not code:
+        promo_cooldown.release(cb.from_user.id)
         return await cb.message.answer("❌ К сожалению, промокоды закончились 😢")
 
-    # Выбираем случайный промокод
-    promo_item = random.choice(promos)
-    code = promo_item["code"] if isinstance(promo_item, dict) else promo_item
+    # Код уже выдан: время последнего промо и история пишутся сразу (уйдут в БД
+    # одной пачкой), что бы дальше ни случилось с сообщением
+    await db.update_last_promo(cb.from_user.id)
+    await db.add_promo_history(cb.from_user.id, code)
+    log.info(f"PROMO -> {cb.from_user.id} = {code}")
 
     # Сообщение пользователю
     msg = (
@@ -233,20 +245,17 @@ async def promo(cb: CallbackQuery):
         "💡 Чтобы активировать его, перейдите на сайт:\n"
         "👉 http://hostilerust.gamestores.app/"
     )
-    await cb.message.edit_caption(
-        caption=msg,
-        reply_markup=back_kb(),
-        parse_mode="HTML"
-    )
-
-    # Логируем в консоль
-    log.info(f"PROMO -> {cb.from_user.id} = {code}")
-
-    # Обновляем время последнего промо и сохраняем в историю
-    await db.update_last_promo(cb.from_user.id)
-    await db.add_promo_history(cb.from_user.id, code)
+    try:
+        await cb.message.edit_caption(
+            caption=msg,
+            reply_markup=BACK_KB,
+            parse_mode="HTML"
+        )
+    except TelegramBadRequest:
+        # Меню без картинки (например, после выхода из админки) — подписи нет, шлём код отдельно
+        await cb.message.answer(msg, reply_markup=BACK_KB, parse_mode="HTML")
 
-@dp.callback_query(F.data == "history")
+@dp.callback_query(F.data == CB.HISTORY)
 async def history(cb: CallbackQuery):
     history = await db.get_user_history(cb.from_user.id)
     if not history:
@@ -255,80 +264,57 @@ async def history(cb: CallbackQuery):
     history_list = "\n".join([f"🎫 {p[0]} ({p[1]})" for p in history])
     await cb.message.edit_caption(
         caption=f"📜 Ваша история промокодов:\n\n{history_list}",
-        reply_markup=back_kb(),
+        reply_markup=BACK_KB,
         parse_mode="Markdown"
     )
 
-@dp.callback_query(F.data == "info")
+@dp.callback_query(F.data == CB.INFO)
 async def info(cb: CallbackQuery):
-    text = (
-        "❓ <b>Информация о промокодах и сервере</b>\n\n"
-        "✏️ Наши соц.сети:\n"
-        "✏️ DISCORD: https://discord.gg/D6Rn6aXDhX\n"
-        "✏️ Группа ВК: https://vk.com/hostile_rust\n\n"
-        "🎁 Промокоды:\n"
-        "- Выдаются через бота\n"
-        "- Чтобы активировать его, зайдите на сайт и авторизуйтесь через Steam: http://hostilerust.gamestores.app/\n\n"
-        "💣 Вайпы:\n"
-        "- Проходят каждый четверг в 12:00 МСК\n"
-        "- Первый четверг месяца в 22:00 МСК\n\n"
-        "⚠️ Правила сервера:\n"
-        "- Не использовать читы/макросы и прочие гадости\n"
-        "- Уважать других игроков\n"
-        "- Соблюдать общие правила серверов *Hostile Rust*"
-    )
-
     await cb.message.edit_caption(
-    caption=text,
-    reply_markup=back_kb(),
+    caption=INFO_TEXT,
+    reply_markup=BACK_KB,
     parse_mode="HTML"
 )
 
-@dp.callback_query(F.data == "link_raid")
+@dp.callback_query(F.data == CB.LINK_RAID)
 async def link_raid(cb: CallbackQuery):
-
-    tg_id = cb.from_user.id
-
-    text = (
-        "🔗 <b>Привязка рейд-уведомлений</b>\n\n"
-        "1️⃣ Зайдите на сервер Hostile Rust и введите /link\n"
-        "2️⃣ Введите ваш код в окно плагина:\n\n"
-        f"<code>{tg_id}</code>\n\n"
-        "3️⃣ После подтверждения вы будете получать\n"
-        "уведомления о разрушении вашей базы в Telegram."
-    )
-
     await cb.message.edit_caption(
-    caption=text,
-    reply_markup=back_kb(),
+    caption=link_raid_text(cb.from_user.id),
+    reply_markup=BACK_KB,
     parse_mode="HTML"
 )   
     
-@dp.callback_query(F.data == "ask_question")
+@dp.callback_query(F.data == CB.ASK_QUESTION)
 async def ask_question(cb: CallbackQuery, state: FSMContext):
-    last_ticket = await db.get_last_ticket(cb.from_user.id)
-    if last_ticket:
-        last_ticket_dt = datetime.fromisoformat(last_ticket)
-        if datetime.now() - last_ticket_dt < timedelta(minutes=TICKET_COOLDOWN_MINUTES):
-            return await cb.message.answer(
-                f"⏳ Вы можете создавать вопрос только раз в {TICKET_COOLDOWN_MINUTES} минут."
-            )
+    wait = await ticket_cooldown.remaining(cb.from_user.id)
+    if wait:
+        return await cb.message.answer(
+            f"⏳ Вы можете создавать вопрос только раз в {TICKET_COOLDOWN_MINUTES} минут. "
+            f"Попробуйте через {format_wait(wait)}."
+        )
 
     await state.set_state(TicketFSM.waiting_question)
     await cb.message.answer("✏️ Напишите подробно ваш вопрос:")
 
+async def poll_servers():
+    """Фоновое обновление кэша статусов серверов"""
+    await status_cache.refresh_all(registry.query_addresses())
+    # Заодно пишем замер в историю онлайна (только ответившие серверы)
+    samples = [
+        (server.name, status["players"], status["max"])
+        for server, status, _ in await server_statuses()
+        if status["online"]
+    ]
+    # При нескольких воркерах кэш обновляет каждый, а пишет в историю только лидер
+    if samples and leader.is_leader:
+        await db.add_online_samples(int(time.time()), samples)
+
+async def rollup_online():
+    await db.rollup_online(int(time.time()), UTC_OFFSET, RAW_DAYS, HOURLY_DAYS, DAILY_DAYS)
+
 async def auto_online_log():
-    x5 = await get_server_status("37.230.137.6", 20601)
-    x100 = await get_server_status("46.174.50.248", 20641)
-    log.info(f"AUTO ONLINE x5={x5} x100={x100}")
-    
-async def wipe_notify():
-    users = load(DATA_USERS, {})
-    for uid in users:
-        try:
-            await bot.send_message(uid, "💣 ВАЙП серверов Hostile Rust!")
-        except:
-            pass
+    online = " ".join(f"{server.name}={status}" for server, status, _ in await server_statuses())
+    log.info(f"AUTO ONLINE {online}")
 
 # ================= ADMIN =================
 
@@ -342,24 +328,24 @@ async def admin(m: Message):
 
     await m.answer(
         "👑 <b>Админ панель Hostile Rust by Derso</b>\n\nВыберите действие:",
-        reply_markup=admin_kb(),
+        reply_markup=ADMIN_KB,
         parse_mode="HTML"
     )
-@dp.callback_query(F.data == "a_add")
+@dp.callback_query(F.data == CB.ADD_PROMO)
 async def a_add(cb: CallbackQuery, state: FSMContext):
     if not is_admin(cb.from_user.id):
         return
     await state.set_state(AdminFSM.addpromo)
     await cb.message.edit_text("✏️ Введите новый промокод:")
 
-@dp.callback_query(F.data == "admin_exit")
+@dp.callback_query(F.data == CB.ADMIN_EXIT)
 async def admin_exit(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return
 
     await cb.message.edit_text(
         main_text(cb.from_user.first_name or "Игрок"),
-        reply_markup=main_kb(),
+        reply_markup=MAIN_KB,
         parse_mode="Markdown"
     )    
     
@@ -367,307 +353,421 @@ async def admin_exit(cb: CallbackQuery):
 async def addpromo(m: Message, state: FSMContext):
     if not is_admin(m.from_user.id):
         return
-    promos = load(DATA_PROMO, [])
-    new_item = {"code": m.text.strip(), "date": datetime.now().isoformat()}
-    promos.append(new_item)
-    save(DATA_PROMO, promos)
+    code = m.text.strip()
     await state.clear()
+    if not await db.add_promo(code, PROMO_EXPIRATION_DAYS):
+        return await m.answer("⚠️ Такой промокод уже есть в списке")
     await m.answer("✅ Промокод успешно добавлен 🎉")
-    log.info(f"ADMIN ADD PROMO {m.text}")
+    log.info(f"ADMIN ADD PROMO {code}")
 
-@dp.callback_query(F.data == "a_del")
-async def a_del(cb: CallbackQuery):
+@dp.callback_query(F.data == CB.DEL_PROMO)
+async def a_del(cb: CallbackQuery, state: FSMContext):
     if not is_admin(cb.from_user.id):
         return
-
-    promos = load(DATA_PROMO, [])
-
-    if not promos:
-        return await cb.message.edit_text("📄 Список промокодов пуст")
-
-    kb = InlineKeyboardBuilder()
-
-    now = datetime.now()
-
-    for p in promos:
-        if isinstance(p, dict):
-            code = p["code"]
-            created = datetime.fromisoformat(p["date"])
-            days_left = PROMO_EXPIRATION_DAYS - (now - created).days
-            text = f"{code} | осталось {days_left} дн."
-        else:
-            code = p
-            text = code
-
-        kb.button(
-            text=f"🗑 {text}",
-            callback_data=f"delpromo_confirm_{code}"
-        )
-
-    kb.button(text="⬅ Назад", callback_data="admin_back")
-
-    kb.adjust(1)
-
-    await cb.message.answer(
-        "❌ Выберите промокод для удаления:",
-        reply_markup=kb.as_markup()
-    )
-@dp.callback_query(F.data.startswith("delpromo_confirm_"))
+    await show_list(cb, state, "delpromos")
+@dp.callback_query(F.data.startswith(CB.DELPROMO_CONFIRM))
 async def confirm_delete_promo(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return
 
-    code = cb.data.replace("delpromo_confirm_", "")
-
-    kb = InlineKeyboardBuilder()
-    kb.button(text="✅ Да, удалить", callback_data=f"delpromo_yes_{code}")
-    kb.button(text="❌ Отмена", callback_data="a_del")
-    kb.adjust(1)
+    promo = await db.get_promo(int(cb.data.replace(CB.DELPROMO_CONFIRM, "")))
+    if not promo:
+        return await cb.answer("❌ Промокод не найден", show_alert=True)
 
     await cb.message.edit_text(
-        f"⚠️ Вы уверены что хотите удалить промокод:\n\n🎫 {code} ?",
-        reply_markup=kb.as_markup()
+        f"⚠️ Вы уверены что хотите удалить промокод:\n\n🎫 {promo[1]} ?",
+        reply_markup=delpromo_confirm_kb(promo[0])
     )
-@dp.callback_query(F.data.startswith("delpromo_yes_"))
+@dp.callback_query(F.data.startswith(CB.DELPROMO_YES))
 async def delete_promo(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return
 
-    code_to_delete = cb.data.replace("delpromo_yes_", "")
+    promo = await db.get_promo(int(cb.data.replace(CB.DELPROMO_YES, "")))
 
-    promos = load(DATA_PROMO, [])
-    new_promos = []
-
-    deleted = False
-
-    for p in promos:
-        code = p["code"] if isinstance(p, dict) else p
-        if code == code_to_delete:
-            deleted = True
-            continue
-        new_promos.append(p)
-
-    if deleted:
-        save(DATA_PROMO, new_promos)
-        log.info(f"ADMIN DEL PROMO {code_to_delete}")
+    if promo and await db.delete_promo(promo[0]):
+        log.info(f"ADMIN DEL PROMO {promo[1]}")
 
         await cb.message.edit_text(
-            f"🗑 Промокод {code_to_delete} успешно удалён ✅",
-            reply_markup=admin_kb()
+            f"🗑 Промокод {promo[1]} успешно удалён ✅",
+            reply_markup=ADMIN_KB
         )
     else:
         await cb.answer("❌ Промокод не найден", show_alert=True)
-@dp.callback_query(F.data == "admin_back")
+@dp.callback_query(F.data == CB.ADMIN_BACK)
 async def admin_back(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return
     await cb.message.edit_text(
         "👑 Админ панель by Derso",
-        reply_markup=admin_kb()
+        reply_markup=ADMIN_KB
     )
 
-@dp.callback_query(F.data == "a_list")
-async def listpromo(cb: CallbackQuery):
+@dp.callback_query(F.data == CB.LIST_PROMOS)
+async def listpromo(cb: CallbackQuery, state: FSMContext):
     if not is_admin(cb.from_user.id):
         return
-    promos = load(DATA_PROMO, [])
-    if not promos:
-        await cb.message.edit_text(
-    f"📋 <b>Список промокодов:</b>\n\n{text}",
-    reply_markup=admin_kb(),
-    parse_mode="HTML"
-)
-        return
+    await show_list(cb, state, "promos")
+
+# ================= ADMIN LISTS =================
+# В сообщение попадает одна страница; запросы keyset, так что листание
+# стоит O(PAGE_SIZE) при любом размере таблиц (см. paging.py)
+
+def list_footer(kb, name, page, total, rows, searchable=False, search=None):
+    """Низ списка: "◀ 1/57 ▶", поиск и возврат в админку"""
+    if rows:
+        pager_row(kb, name, page, page_count(total), rows[0][0], rows[-1][0])
+    if searchable:
+        buttons = [InlineKeyboardButton(text="🔍 Поиск", callback_data=f"{CB.SEARCH}{name}")]
+        if search:
+            buttons.append(InlineKeyboardButton(text="✖ Сбросить поиск", callback_data=f"{CB.CLEAR_SEARCH}{name}"))
+        kb.row(*buttons)
+    kb.row(*ADMIN_BACK_KB.inline_keyboard[0])
+
+def search_title(search):
+    return f" по запросу «{escape(search)}»" if search else ""
+
+async def users_list(state, page=1, after=None, before=None):
+    search = (await state.get_data()).get("search_users")
+    total = await db.count_users(search)
+    rows = await db.get_users_page(after, before, search, PAGE_SIZE)
+
+    text = "\n".join(
+        f"👤 <code>{user_id}</code> {escape(name or '')} (@{escape(username or '-')})" + (" 🚫" if blocked_at else "")
+        for user_id, name, username, blocked_at in rows
+    ) or "Пусто"
 
-    text_list = []
-    for p in promos:
-        if isinstance(p, dict) and "code" in p:
-            text_list.append(f"🎫 {p['code']}")
-        elif isinstance(p, str):
-            text_list.append(f"🎫 {p}")
-    text = "\n".join(text_list) if text_list else "📄 Список промокодов пуст"
-    await cb.message.answer(text)
+    kb = InlineKeyboardBuilder()
+    list_footer(kb, "users", page, total, rows, searchable=True, search=search)
+    return f"👥 <b>Пользователи{search_title(search)}</b> ({total}):\n\n{text}", kb.as_markup()
 
-@dp.message(TicketFSM.waiting_question)
-async def save_question(m: Message, state: FSMContext):
-    # Сохраняем тикет в БД
-    await db.add_ticket(m.from_user.id, m.from_user.username or "", m.from_user.first_name or "", m.text)
-    await state.clear()
-    await m.answer("✅ Ваш вопрос отправлен администрации *Hostile Rust*! Ожидайте ответа.")
+async def tickets_list(state, page=1, after=None, before=None):
+    search = (await state.get_data()).get("search_tickets")
+    total = await db.count_open_tickets(search)
+    rows = await db.get_tickets_page(after, before, search, PAGE_SIZE)
+
+    # Длинные вопросы обрезаем, чтобы страница влезла в лимит сообщения
+    text = "\n\n".join(
+        f"#{ticket_id} | @{escape(username or '-')}\n{escape((question or '')[:300])}"
+        for ticket_id, _, username, _, question in rows
+    ) or "📭 Нет активных вопросов"
 
-    # уведомление админам
-    tickets = await db.get_open_tickets()
-    ticket_id = tickets[-1][0]  # последний добавленный
     kb = InlineKeyboardBuilder()
-    kb.button(text="✏️ Ответить", callback_data=f"ticket_answer_{ticket_id}")
-    kb.adjust(1)
+    for ticket_id, *_ in rows:
+        kb.button(text=f"✏️ #{ticket_id}", callback_data=f"{CB.TICKET_ANSWER}{ticket_id}")
+    kb.adjust(5)
+    list_footer(kb, "tickets", page, total, rows, searchable=True, search=search)
+    return f"📩 <b>Активные вопросы{search_title(search)}</b> ({total}):\n\n{text}", kb.as_markup()
 
-    for admin_id in ADMIN_IDS:
-        await bot.send_message(
-            admin_id,
-            f"📩 Новый вопрос под номером #{ticket_id}\n\n"
-            f"👤 @{m.from_user.username}\n"
-            f"👤 {m.from_user.first_name}\n"
-            f"📝 {m.text}",
-            reply_markup=kb.as_markup()
+async def promos_list(state, page=1, after=None, before=None):
+    total = await db.count_promos()
+    rows = await db.get_promos_page(after, before, PAGE_SIZE)
+
+    text = "\n".join(
+        f"🎫 {escape(code)} | осталось {days_left(expires_at)} дн." for _, code, expires_at in rows
+    ) or "📄 Список промокодов пуст"
+
+    kb = InlineKeyboardBuilder()
+    list_footer(kb, "promos", page, total, rows)
+    return f"📋 <b>Список промокодов</b> ({total}):\n\n{text}", kb.as_markup()
+
+async def delpromos_list(state, page=1, after=None, before=None):
+    total = await db.count_promos()
+    rows = await db.get_promos_page(after, before, PAGE_SIZE)
+
+    kb = InlineKeyboardBuilder()
+    for promo_id, code, expires_at in rows:
+        kb.button(
+            text=f"🗑 {code} | осталось {days_left(expires_at)} дн.",
+            callback_data=f"{CB.DELPROMO_CONFIRM}{promo_id}"
         )
-        
-@dp.callback_query(F.data == "a_tickets")
-async def list_tickets(cb: CallbackQuery):
+    kb.adjust(1)
+    list_footer(kb, "delpromos", page, total, rows)
+    return ("❌ Выберите промокод для удаления:" if rows else "📄 Список промокодов пуст"), kb.as_markup()
+
+ADMIN_LISTS = {
+    "users": users_list,
+    "tickets": tickets_list,
+    "promos": promos_list,
+    "delpromos": delpromos_list,
+}
+
+async def show_list(cb, state, name, page=1, after=None, before=None):
+    text, markup = await ADMIN_LISTS[name](state, page, after, before)
+    await cb.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+
+@dp.callback_query(F.data.startswith(PREFIX))
+async def list_page(cb: CallbackQuery, state: FSMContext):
+    if not is_admin(cb.from_user.id):
+        return
+    if cb.data == NOOP:
+        return await cb.answer()
+    name, page, after, before = parse_pager(cb.data)
+    await show_list(cb, state, name, page, after, before)
+
+@dp.callback_query(F.data.startswith(CB.SEARCH))
+async def list_search(cb: CallbackQuery, state: FSMContext):
     if not is_admin(cb.from_user.id):
         return
+    await state.set_state(AdminFSM.search)
+    await state.update_data(search_list=cb.data.replace(CB.SEARCH, ""))
+    await cb.message.edit_text("🔍 Введите username или ID:")
+
+@dp.message(AdminFSM.search)
+async def list_search_query(m: Message, state: FSMContext):
+    if not is_admin(m.from_user.id):
+        return
+    name = (await state.get_data())["search_list"]
+    # Запрос остаётся в данных FSM, пока его не сбросят: с ним листаются страницы
+    await state.set_state(None)
+    await state.update_data({f"search_{name}": (m.text or "").strip() or None})
+    text, markup = await ADMIN_LISTS[name](state)
+    await m.answer(text, reply_markup=markup, parse_mode="HTML")
+
+@dp.callback_query(F.data.startswith(CB.CLEAR_SEARCH))
+async def list_search_clear(cb: CallbackQuery, state: FSMContext):
+    if not is_admin(cb.from_user.id):
+        return
+    name = cb.data.replace(CB.CLEAR_SEARCH, "")
+    await state.update_data({f"search_{name}": None})
+    await show_list(cb, state, name)
+
+# ================= TICKETS =================
+
+def ticket_thread(ticket, messages):
+    """Вопрос и последние сообщения переписки; длинные обрезаем, чтобы влезть в сообщение"""
+    lines = [f"👤 {(ticket[4] or '')[:500]}"]
+    for from_admin, text, _ in messages:
+        lines.append(f"{'👑' if from_admin else '👤'} {(text or '')[:500]}")
+    return "\n\n".join(lines)
+
+async def notify_admins(text, reply_markup=None, admin_ids=None):
+    """Шлёт сообщение админам параллельно; недоступный админ не задерживает остальных"""
+    admin_ids = ADMIN_IDS if admin_ids is None else admin_ids
+    results = await asyncio.gather(
+        *(bot.send_message(admin_id, text, reply_markup=reply_markup) for admin_id in admin_ids),
+        return_exceptions=True,
+    )
+    for admin_id, result in zip(admin_ids, results):
+        if isinstance(result, Exception):
+            log.error(f"ADMIN NOTIFY {admin_id} -> {result}")
 
-    tickets = await db.get_open_tickets()
-    if not tickets:
-        return await cb.message.edit_text("📭 Нет активных вопросов", reply_markup=admin_kb())
+@dp.message(TicketFSM.waiting_question)
+async def save_question(m: Message, state: FSMContext):
+    ticket_id = await db.add_ticket(m.from_user.id, m.from_user.username or "", m.from_user.first_name or "", m.text)
+    ticket_cooldown.mark(m.from_user.id)
+    await state.clear()
+    await m.answer("✅ Ваш вопрос отправлен администрации *Hostile Rust*! Ожидайте ответа.")
+    log.info(f"TICKET #{ticket_id} from {m.from_user.id}")
+
+    await notify_admins(
+        f"📩 Новый вопрос под номером #{ticket_id}\n\n"
+        f"👤 @{m.from_user.username}\n"
+        f"👤 {m.from_user.first_name}\n"
+        f"📝 {m.text}",
+        ticket_admin_kb(ticket_id)
+    )
 
-    text = "📩 <b>Активные вопросы:</b>\n\n"
-    for t in tickets:
-        text += f"#{t[0]} | @{t[2]}\n{t[4]}\n\n"
+@dp.callback_query(F.data.startswith(CB.TICKET_REPLY))
+async def ticket_reply_start(cb: CallbackQuery, state: FSMContext):
+    ticket_id = int(cb.data.split("_")[-1])
+    ticket = await db.get_ticket(ticket_id)
+    if not ticket or ticket[1] != cb.from_user.id:
+        return await cb.answer("❌ Вопрос не найден", show_alert=True)
 
-    await cb.message.edit_text(text, reply_markup=admin_kb(), parse_mode="HTML")
+    await state.update_data(ticket_id=ticket_id)
+    await state.set_state(TicketFSM.waiting_reply)
+    await cb.message.answer(f"✏️ Напишите ответ по вопросу #{ticket_id}:")
+
+@dp.message(TicketFSM.waiting_reply)
+async def ticket_reply_send(m: Message, state: FSMContext):
+    ticket_id = (await state.get_data()).get("ticket_id")
+    await state.clear()
+    ticket = await db.get_ticket(ticket_id) if ticket_id else None
+    if not ticket or ticket[1] != m.from_user.id:
+        return await m.answer("❌ Вопрос не найден")
+
+    # Ответ игрока переоткрывает закрытый тикет, переписка продолжается в нём же
+    await db.reopen_ticket(ticket_id, m.from_user.id)
+    await db.add_ticket_message(ticket_id, m.from_user.id, False, m.text)
+    await m.answer("✅ Ответ передан администрации")
+    log.info(f"TICKET #{ticket_id} reply from {m.from_user.id}")
+
+    # Если вопрос за кем-то закреплён — пишем только ему
+    await notify_admins(
+        f"↩️ Игрок ответил по вопросу #{ticket_id}\n\n"
+        f"👤 @{ticket[2]}\n"
+        f"📝 {m.text}",
+        ticket_admin_kb(ticket_id),
+        [ticket[6]] if ticket[6] else None
+    )
+
+@dp.callback_query(F.data == CB.LIST_TICKETS)
+async def list_tickets(cb: CallbackQuery, state: FSMContext):
+    if not is_admin(cb.from_user.id):
+        return
+    await show_list(cb, state, "tickets")
         
-@dp.callback_query(F.data.startswith("ticket_answer_"))
+@dp.callback_query(F.data.startswith(CB.TICKET_ANSWER))
 async def ticket_answer_start(cb: CallbackQuery, state: FSMContext):
     if not is_admin(cb.from_user.id):
         return
 
     ticket_id = int(cb.data.split("_")[-1])
+    ticket = await db.get_ticket(ticket_id)
+    if not ticket or ticket[5] != "open":
+        return await cb.answer("❌ Вопрос не найден или уже закрыт", show_alert=True)
+    # Отвечающий забирает вопрос себе, чтобы два админа не писали ответ одновременно.
+    # Закрепление снимается кнопкой "Отпустить" или само истекает (Database.ticket_lock_ttl)
+    if not await db.assign_ticket(ticket_id, cb.from_user.id):
+        return await cb.answer("✋ Этот вопрос уже взял другой админ", show_alert=True)
 
     await state.update_data(ticket_id=ticket_id)
     await state.set_state(AdminFSM.ticket_answer)
 
-    await cb.message.answer(f"✏️ Введите ответ на вопрос. Номер:#{ticket_id}:")
-    
+    messages = await db.get_ticket_messages(ticket_id)
+    await cb.message.answer(
+        f"✏️ Введите ответ на вопрос #{ticket_id}:\n\n{ticket_thread(ticket, messages)}",
+        reply_markup=ticket_release_kb(ticket_id)
+    )
+
+@dp.callback_query(F.data.startswith(CB.TICKET_TAKE))
+async def ticket_take(cb: CallbackQuery):
+    if not is_admin(cb.from_user.id):
+        return
+
+    ticket_id = int(cb.data.split("_")[-1])
+    if await db.assign_ticket(ticket_id, cb.from_user.id):
+        log.info(f"TICKET #{ticket_id} assigned to {cb.from_user.id}")
+        await cb.answer(f"✅ Вопрос #{ticket_id} закреплён за вами", show_alert=True)
+    else:
+        await cb.answer("✋ Вопрос уже закрыт или его взял другой админ", show_alert=True)
+
+@dp.callback_query(F.data.startswith(CB.TICKET_RELEASE))
+async def ticket_release(cb: CallbackQuery, state: FSMContext):
+    if not is_admin(cb.from_user.id):
+        return
+
+    ticket_id = int(cb.data.split("_")[-1])
+    # Бросил ответ на этот вопрос — выходим из ввода ответа
+    if (await state.get_data()).get("ticket_id") == ticket_id:
+        await state.clear()
+    if await db.release_ticket(ticket_id, cb.from_user.id):
+        log.info(f"TICKET #{ticket_id} released by {cb.from_user.id}")
+        await cb.answer(f"↩️ Вопрос #{ticket_id} снова свободен", show_alert=True)
+    else:
+        await cb.answer("❌ Этот вопрос не закреплён за вами", show_alert=True)
+
+@dp.callback_query(F.data.startswith(CB.TICKET_CLOSE))
+async def ticket_close(cb: CallbackQuery):
+    if not is_admin(cb.from_user.id):
+        return
+
+    ticket_id = int(cb.data.split("_")[-1])
+    ticket = await db.get_ticket(ticket_id)
+    if ticket and ticket[6] not in (None, cb.from_user.id):
+        return await cb.answer("✋ Этот вопрос взял другой админ", show_alert=True)
+    if ticket and await db.close_ticket(ticket_id):
+        log.info(f"TICKET #{ticket_id} closed by {cb.from_user.id}")
+        await cb.answer(f"✅ Вопрос #{ticket_id} закрыт", show_alert=True)
+    else:
+        await cb.answer("❌ Вопрос не найден или уже закрыт", show_alert=True)
+
 @dp.message(AdminFSM.ticket_answer)
 async def ticket_answer_send(m: Message, state: FSMContext):
     data = await state.get_data()
     ticket_id = data.get("ticket_id")
+    await state.clear()
 
-    # Получаем тикет из БД
-    tickets = await db.get_open_tickets()
-    ticket = next((t for t in tickets if t[0] == ticket_id), None)
-
-    if not ticket:
+    ticket = await db.get_ticket(ticket_id) if ticket_id else None
+    # Закрытие атомарное: если вопрос уже закрыли, второй ответ игроку не уйдёт
+    if not ticket or not await db.close_ticket(ticket_id):
         return await m.answer("❌ Вопрос не найден или уже закрыт")
+    await db.add_ticket_message(ticket_id, m.from_user.id, True, m.text)
+    log.info(f"TICKET #{ticket_id} answered by {m.from_user.id}")
 
     try:
-        await bot.send_message(ticket[1], f"📩 Ответ на ваш вопрос #{ticket_id}:\n\n{m.text}")
-    except:
-        pass
+        await bot.send_message(
+            ticket[1],
+            f"📩 Ответ на ваш вопрос #{ticket_id}:\n\n{m.text}",
+            reply_markup=ticket_reply_kb(ticket_id)
+        )
+    except Exception as e:
+        log.error(f"TICKET #{ticket_id} answer not delivered -> {e}")
+        return await m.answer("⚠️ Ответ сохранён, но игроку его доставить не удалось")
 
-    await db.answer_ticket(ticket_id)
-    await state.clear()
     await m.answer("✅ Ответ отправлен игроку")
 
-@dp.callback_query(F.data == "a_users")
-async def listusers(cb: CallbackQuery):
+@dp.callback_query(F.data == CB.LIST_USERS)
+async def listusers(cb: CallbackQuery, state: FSMContext):
     if not is_admin(cb.from_user.id):
         return
+    await show_list(cb, state, "users")
 
-    async with aiosqlite.connect(db.path) as conn:
-        cursor = await conn.execute("SELECT first_name, username FROM users")
-        users = await cursor.fetchall()
-
-    text = "\n".join([f"👤 {u[0]} (@{u[1]})" for u in users]) or "Пусто"
-    await cb.message.edit_text(
-        f"👥 <b>Пользователи:</b>\n\n{text}",
-        reply_markup=admin_kb(),
-        parse_mode="HTML"
-    )
-
-@dp.callback_query(F.data == "a_stats")
+@dp.callback_query(F.data == CB.STATS)
 async def stats(cb: CallbackQuery):
     if not is_admin(cb.from_user.id):
         return
 
-    total_users = await db.count_users()
-    total_promos = await db.count_total_promos()
-
-    async with aiosqlite.connect(db.path) as conn:
-        cursor = await conn.execute("""
-            SELECT u.first_name, u.username, COUNT(p.id) as promo_count
-            FROM users u
-            LEFT JOIN promo_history p ON u.telegram_id = p.telegram_id
-            GROUP BY u.telegram_id
-            ORDER BY promo_count DESC
-            LIMIT 1
-        """)
-        most_active = await cursor.fetchone()
-
-    active_text = f"{most_active[0]} (@{most_active[1]})" if most_active else "Нет"
+    flood = throttling.stats()
+    dropped = ", ".join(f"{name}: {count}" for name, count in flood["dropped"].items()) or "нет"
 
     text = (
-        f"📊 Статистика бота:\n\n"
-        f"👥 Подписано всего пользователей: {total_users}\n"
-        f"🎁 Всего выдано промокодов: {total_promos}\n"
-        f"🏆 Самый активный игрок: {active_text}"
+        await stats_report(db) + "\n\n"
+        f"🛡 Анти-флуд: пропущено {flood['passed']}, отброшено {dropped}"
     )
     await cb.message.edit_text(
         text,
-        reply_markup=admin_kb()
+        reply_markup=ADMIN_KB
     )
 
 # ================= BROADCAST =================
 
-@dp.callback_query(F.data == "servers")
+@dp.callback_query(F.data == CB.SERVERS)
 async def servers(cb: CallbackQuery):
 
-    x5, x100 = await asyncio.gather(
-        get_server_status("37.230.137.6", 20601),
-        get_server_status("46.174.50.248", 20641)
-    )
+    # Статусы берём из кэша: его держит свежим фоновый poll_servers
+    statuses = await server_statuses()
 
     def fmt(name, data):
         if not data["online"]:
             return f"🔴 {name}: оффлайн"
         return f"🟢 {name}: {data['players']}/{data['max']}"
 
+    lines = "\n".join(fmt(server.name, status) for server, status, _ in statuses)
     text = (
         "🎮 *Статус серверов Hostile Rust*\n\n"
-        f"{fmt('x5', x5)}\n"
-        f"{fmt('x100', x100)}"
+        f"{lines}\n\n"
+        f"🕒 Обновлено {format_age(max(age for _, _, age in statuses))}"
     )
 
     await cb.message.edit_caption(
     caption=text,
-    reply_markup=back_kb(),
+    reply_markup=BACK_KB,
     parse_mode="Markdown"
 )
 
 
     
-@dp.callback_query(F.data == "ips")
-async def ips(cb: CallbackQuery):
-
-    kb = InlineKeyboardBuilder()
+@dp.callback_query(F.data == CB.ONLINE_CHART)
+async def online_chart(cb: CallbackQuery):
+    reports = await asyncio.gather(*(online_report(db, server, UTC_OFFSET) for server in registry))
 
-    kb.button(
-        text="📋 Скопировать Hostile x5",
-        switch_inline_query_current_chat="connect 37.230.137.6:20600"
-    )
-
-    kb.button(
-        text="📋 Скопировать Hostile x100",
-        switch_inline_query_current_chat="connect 46.174.50.248:20640"
+    await cb.message.edit_caption(
+        caption="📈 *Онлайн серверов Hostile Rust*\n\n" + "\n\n".join(reports),
+        reply_markup=BACK_KB,
+        parse_mode="Markdown"
     )
 
-    # КНОПКА НАЗАД
-    kb.button(text="⬅️ Назад", callback_data="back_main")
-
-    kb.adjust(1)
-
+@dp.callback_query(F.data == CB.IPS)
+async def ips(cb: CallbackQuery):
     await cb.message.edit_caption(
-        caption=(
-            "📜 *IP серверов Hostile Rust*\n\n"
-            "Нажми кнопку — команда появится в поле ввода.\n"
-            "Дальше просто скопируй и вставь в консоли игры 👇"
-        ),
-        reply_markup=kb.as_markup(),
+        caption=IPS_TEXT,
+        reply_markup=IPS_KB,
         parse_mode="Markdown"
     )
 
-@dp.callback_query(F.data == "a_bc")
+@dp.callback_query(F.data == CB.BROADCAST)
 async def bc_start(cb: CallbackQuery, state: FSMContext):
     if not is_admin(cb.from_user.id):
         return
@@ -679,40 +779,77 @@ async def bc_text(m: Message, state: FSMContext):
     if not is_admin(m.from_user.id):
         return
     await state.update_data(bc_text=m.text)
-    kb = InlineKeyboardBuilder()
-    kb.button(text="📤 Отправить всем", callback_data="bc_send_all")
-    kb.button(text="📤 Только новым игрокам", callback_data="bc_send_new")
-    kb.button(text="❌ Отменить рассылку", callback_data="bc_cancel")
-    kb.adjust(2)
     await state.set_state(AdminFSM.broadcast_confirm)
-    await m.answer(f"📢 Текст рассылки:\n\n{m.text}", reply_markup=kb.as_markup())
+    await m.answer(f"📢 Текст рассылки:\n\n{m.text}", reply_markup=BC_CONFIRM_KB)
 
-@dp.callback_query(F.data.startswith("bc_send"))
+# Кнопка подтверждения -> сегмент получателей (см. broadcast.SEGMENTS)
+BC_SEGMENTS = {
+    CB.BC_SEND_ALL: "all",
+    CB.BC_SEND_NEW: "new",
+    CB.BC_SEND_ACTIVE: "active",
+    CB.BC_SEND_RAID: "raid",
+}
+
+@dp.callback_query(F.data.in_(BC_SEGMENTS))
 async def bc_send(cb: CallbackQuery, state: FSMContext):
     if not is_admin(cb.from_user.id):
         return
 
     data = await state.get_data()
     text = data.get("bc_text")
+    # Повторный клик или старое сообщение с кнопками: текст уже забран первым кликом
+    if not text:
+        return await cb.answer("❌ Текст рассылки не найден, начните заново", show_alert=True)
+    await state.clear()
 
-    if cb.data == "bc_send_new":
-        targets = await db.get_users_without_promos()
-    else:
-        targets = await db.get_all_user_ids()
+    # Рассылка идёт фоновым заданием и переживает перезапуск бота;
+    # прогресс и кнопки паузы/отмены будут в этом же сообщении
+    await cb.message.edit_text("📢 Рассылка запускается...")
+    job_id = await broadcasts.start(
+        text,
+        BC_SEGMENTS[cb.data],
+        chat_id=cb.message.chat.id,
+        message_id=cb.message.message_id
+    )
+    log.info(f"ADMIN BROADCAST -> job #{job_id}")
 
-    sent = 0
-    for u in targets:
-        try:
-            await bot.send_message(u, text)
-            sent += 1
-        except:
-            pass
+@dp.callback_query(F.data == CB.BROADCAST_JOBS)
+async def list_jobs(cb: CallbackQuery):
+    if not is_admin(cb.from_user.id):
+        return
 
-    await state.clear()
-    await cb.message.edit_text(f"✅ Рассылка завершена!\nОтправлено: {sent} пользователям")
-    log.info(f"ADMIN BROADCAST -> {sent} users")
+    jobs = await db.get_broadcast_jobs()
+    if not jobs:
+        return await cb.message.edit_text("📭 Рассылок ещё не было", reply_markup=ADMIN_KB)
 
-@dp.callback_query(F.data == "bc_cancel")
+    kb = InlineKeyboardBuilder()
+    text = "📦 <b>Последние рассылки:</b>\n\n"
+    for job_id, job_text, _, status, _, sent, failed, blocked, _, _ in jobs:
+        text += f"#{job_id} | {STATUS_TEXT[status]} | ✅ {sent} 🚫 {blocked} ❌ {failed}\n{job_text[:50]}\n\n"
+        if status == "running":
+            kb.button(text=f"⏸ #{job_id}", callback_data=f"{CB.BCJOB}pause_{job_id}")
+        elif status == "paused":
+            kb.button(text=f"▶ #{job_id}", callback_data=f"{CB.BCJOB}resume_{job_id}")
+        if status in ("running", "paused"):
+            kb.button(text=f"✖ #{job_id}", callback_data=f"{CB.BCJOB}cancel_{job_id}")
+    kb.button(text="⬅ Назад", callback_data=CB.ADMIN_BACK)
+    kb.adjust(2)
+
+    await cb.message.edit_text(text, reply_markup=kb.as_markup(), parse_mode="HTML")
+
+@dp.callback_query(F.data.startswith(CB.BCJOB))
+async def job_control(cb: CallbackQuery):
+    if not is_admin(cb.from_user.id):
+        return
+
+    action, job_id = cb.data.replace(CB.BCJOB, "").split("_")
+    if action not in ("pause", "resume", "cancel"):
+        return
+    await cb.answer()
+    await getattr(broadcasts, action)(int(job_id))
+    log.info(f"ADMIN BROADCAST {action.upper()} -> job #{job_id}")
+
+@dp.callback_query(F.data == CB.BC_CANCEL)
 async def bc_cancel(cb: CallbackQuery, state: FSMContext):
     if not is_admin(cb.from_user.id):
         return
@@ -721,69 +858,130 @@ async def bc_cancel(cb: CallbackQuery, state: FSMContext):
 
 # ================= WIPE =================
 
-def next_wipe():
-    now = datetime.now(tz)
-
-    for i in range(14):
-        d = now + timedelta(days=i)
-        if d.weekday() == 3:
-            hour = 22 if d.day <= 7 else 12
-            wipe = tz.localize(datetime(d.year, d.month, d.day, hour))
-            if wipe > now:
-                return wipe
-
-@dp.callback_query(F.data == "wipe")
+@dp.callback_query(F.data == CB.WIPE)
 async def wipe_timer(cb: CallbackQuery):
-    wipe = next_wipe()
     now = datetime.now(tz)
 
-    diff = wipe - now
+    text = "💣 *До следующего вайп на серверах Hostile Rust*\n"
+    for wipe, wiped in registry.next_wipes(tz, now).items():
+        diff = wipe - now
 
-    days = diff.days
-    hours = diff.seconds // 3600
-    minutes = (diff.seconds % 3600) // 60
+        days = diff.days
+        hours = diff.seconds // 3600
+        minutes = (diff.seconds % 3600) // 60
 
-    text = (
-        "💣 *До следующего вайп на серверах Hostile Rust*\n\n"
-        f"⏳ Осталось:\n"
-        f"🗓 {days} дн\n"
-        f"🕒 {hours} ч\n"
-        f"⏱ {minutes} мин"
-    )
+        text += (
+            f"\n🖥 {', '.join(s.name for s in wiped)}\n"
+            f"⏳ Осталось:\n"
+            f"🗓 {days} дн\n"
+            f"🕒 {hours} ч\n"
+            f"⏱ {minutes} мин\n"
+        )
 
     await cb.message.edit_caption(
     caption=text,
-    reply_markup=back_kb(),
+    reply_markup=BACK_KB,
     parse_mode="Markdown"
 )
     
-async def wipe_notify():
-    users = await db.get_all_user_ids()
-    for uid in users:
-        try:
-            await bot.send_message(uid, "💣 ВАЙП СЕРВЕРОВ HOSTILE RUST!")
-        except:
-            pass
+async def wipe_notify(names):
+    job_id = await broadcasts.start(f"💣 ВАЙП СЕРВЕРОВ HOSTILE RUST! ({', '.join(names)})")
+    log.info(f"WIPE NOTIFY {names} -> job #{job_id}")
 
-async def wipe_warning():
-    users = await db.get_all_user_ids()
-    for uid in users:
-        try:
-            await bot.send_message(uid, "⚠️ Через 1 час вайп серверов Hostile Rust!")
-        except:
-            pass
+async def wipe_warning(names):
+    job_id = await broadcasts.start(f"⚠️ Через 1 час вайп серверов Hostile Rust! ({', '.join(names)})")
+    log.info(f"WIPE WARNING {names} -> job #{job_id}")
 # ================= START =================
 
-async def main():
+async def startup(metrics_port=METRICS_PORT, raid_endpoint=True):
+    global metrics_server
+    if metrics_port:
+        metrics_server = MetricsServer(METRICS_HOST, metrics_port)
+        await metrics_server.start()
+    await db.open()  # Одно соединение на всё время работы бота
     await db.init()  # Инициализация БД
+    await leader.renew()
+    if leader.is_leader:
+        await import_legacy_promos()
+    await fsm_storage.start()  # Поднимаем незаконченные диалоги админов и тикетов
+    await broadcasts.resume_all()  # Продолжаем рассылки, прерванные перезапуском
+    if raid_endpoint and raid.config.enabled:
+        await raid.start()  # Приём рейд-событий от плагина (см. raid.py)
     schedule()
     scheduler.start()
-    scheduler.add_job(auto_online_log, "interval", minutes=5)
+    scheduler.add_job(leader.renew, "interval", seconds=LEASE_RENEW)
+    scheduler.add_job(schedule, "interval", hours=1)  # Оповещения о следующем вайпе
+    scheduler.add_job(poll_servers, "interval", seconds=POLL_INTERVAL, next_run_time=datetime.now(tz))
+    scheduler.add_job(leader.only(auto_online_log), "interval", minutes=5)
+    scheduler.add_job(leader.only(rollup_online), "cron", minute=1)
+    scheduler.add_job(leader.only(db.delete_expired_promos), "interval", hours=1)
+    # Рассылки выполняет лидер; так он подхватывает созданные другими воркерами
+    scheduler.add_job(broadcasts.resume_all, "interval", seconds=5)
+
+async def shutdown():
+    scheduler.shutdown(wait=False)
+    await broadcasts.shutdown()
+    await raid.close()
+    a2s_client.close()
+    await fsm_storage.close()
+    await leader.release()
+    await db.close()
+    if metrics_server is not None:
+        await metrics_server.close()
+
+async def main(log_queue=None):
+    if BOT_WORKERS > 1:
+        # Многопроцессный режим: этот процесс только принимает апдейты и раздаёт их воркерам
+        supervisor = Supervisor(bot, dp, BOT_WORKERS, worker_process, args=(log_queue,))
+        supervisor.start()
+        log.info("BOT STARTED (supervisor)")
+        try:
+            if BOT_MODE == "webhook":
+                await WebhookServer(dp, bot, WebhookConfig.from_env(), feed=supervisor.feed).run()
+            else:
+                await supervisor.poll()
+        finally:
+            await supervisor.stop()
+        return
+
+    await startup()
     log.info("BOT STARTED")
-    await dp.start_polling(bot)
+    try:
+        if BOT_MODE == "webhook":
+            await WebhookServer(dp, bot, WebhookConfig.from_env()).run()
+        else:
+            # start_polling сам вебхук не снимает, а с ним getUpdates отвечает конфликтом
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        await shutdown()
+
+async def worker_main(index, queue):
+    # Эндпоинт рейдов один на всех, иначе дедупликация разъедется по процессам
+    await startup(METRICS_PORT + 1 + index if METRICS_PORT else 0, raid_endpoint=index == 0)
+    log.info(f"WORKER {index} STARTED")
+    try:
+        await consume(queue, bot, dp)
+    finally:
+        await shutdown()
+        await bot.session.close()
+
+def worker_process(index, queue, log_queue):
+    # Ctrl+C и SIGTERM получает вся группа процессов; останавливает воркеры супервизор через очередь
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    setup_logging(queue=log_queue)
+    asyncio.run(worker_main(index, queue))
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    log_queue = multiprocessing.get_context("spawn").Queue() if BOT_WORKERS > 1 else None
+    log_listener = setup_logging(LOG_FILE, LOG_JSON, log_queue)
+    try:
+        asyncio.run(main(log_queue))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        log_listener.stop()  # Дописывает всё, что осталось в очереди
 
 
 
@@ -0,0 +1,313 @@
+import asyncio
+import logging
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+
+from keyboards import job_kb
+from metrics import BROADCAST_MESSAGES
+
+log = logging.getLogger("bot")
+
+# Лимиты Telegram: ~30 сообщений в секунду на бота и ~1 в секунду в один чат
+GLOBAL_RATE = 25
+CHAT_RATE = 1
+WORKERS = 8
+BATCH_SIZE = 500
+MAX_ATTEMPTS = 3
+PROGRESS_INTERVAL = 3  # секунды между обновлениями прогресса
+ACTIVE_DAYS = 30
+
+# Сегмент задания -> фильтры Database.iter_recipients
+SEGMENTS = {
+    "all": {},
+    "new": {"without_promos": True},
+    "active": {"active_days": ACTIVE_DAYS},
+    "raid": {"raid_linked": True},
+}
+
+
+class RateLimiter:
+    """Общий лимит на бота + лимит на каждый чат.
+
+    Слоты раздаются по очереди: каждый вызов wait() резервирует следующий
+    свободный момент и спит до него, так что воркеры не устраивают гонку.
+    """
+
+    def __init__(self, rate=GLOBAL_RATE, chat_rate=CHAT_RATE):
+        self.interval = 1 / rate
+        self.chat_interval = 1 / chat_rate
+        self._next = 0.0
+        self._chats = {}
+        self._lock = asyncio.Lock()
+
+    async def wait(self, chat_id):
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            slot = max(now, self._next, self._chats.get(chat_id, 0.0))
+            self._next = slot + self.interval
+            self._chats[chat_id] = slot + self.chat_interval
+            if len(self._chats) > 10000:
+                self._chats = {c: t for c, t in self._chats.items() if t > now}
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def pause(self, seconds):
+        """После 429 притормаживаем всех, а не только упавший воркер"""
+        loop = asyncio.get_running_loop()
+        self._next = max(self._next, loop.time() + seconds)
+
+
+class BroadcastStats:
+    def __init__(self, sent=0, failed=0, blocked=0):
+        # Начальные значения нужны при продолжении задания после перезапуска
+        self.sent = sent
+        self.failed = failed
+        self.blocked = blocked
+        self.started = asyncio.get_running_loop().time()
+        self._done_at_start = self.done
+
+    @property
+    def done(self):
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def speed(self):
+        elapsed = asyncio.get_running_loop().time() - self.started
+        return (self.done - self._done_at_start) / elapsed if elapsed > 0 else 0.0
+
+    def format(self, total=None):
+        progress = f"{self.done}/{total}" if total else str(self.done)
+        return (
+            f"📤 Обработано: {progress}\n"
+            f"✅ Доставлено: {self.sent}\n"
+            f"🚫 Заблокировали бота: {self.blocked}\n"
+            f"❌ Ошибок: {self.failed}\n"
+            f"⚡ Скорость: {self.speed:.1f} сообщ/с"
+        )
+
+
+class Broadcaster:
+    def __init__(self, bot, db, limiter=None, workers=WORKERS):
+        self.bot = bot
+        self.db = db
+        self.limiter = limiter or RateLimiter()
+        self.workers = workers
+
+    async def send(self, chat_id, text, **kwargs):
+        """Одно сообщение с учётом лимитов. Возвращает 'sent', 'blocked' или 'failed'"""
+        for _ in range(MAX_ATTEMPTS):
+            await self.limiter.wait(chat_id)
+            try:
+                await self.bot.send_message(chat_id, text, **kwargs)
+                return "sent"
+            except TelegramRetryAfter as e:
+                log.warning(f"BROADCAST 429 -> retry after {e.retry_after}s")
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                await self.db.mark_blocked(chat_id)
+                return "blocked"
+            except Exception as e:
+                log.error(f"BROADCAST error {chat_id} -> {e}")
+                return "failed"
+        return "failed"
+
+    async def run(self, text, recipients, progress=None, stats=None, stop=None, on_result=None):
+        """Рассылает text по асинхронному итератору id.
+
+        progress — необязательная корутина progress(stats), вызывается
+        не чаще раза в PROGRESS_INTERVAL секунд и один раз в конце.
+        stop — asyncio.Event: после него новые получатели не берутся,
+        уже взятые в очередь дорассылаются. on_result(chat_id, result)
+        вызывается после каждой отправки.
+        """
+        stats = stats or BroadcastStats()
+        queue = asyncio.Queue(maxsize=self.workers * 4)
+
+        async def worker():
+            while True:
+                chat_id = await queue.get()
+                try:
+                    result = await self.send(chat_id, text)
+                    BROADCAST_MESSAGES.inc(result)
+                    setattr(stats, result, getattr(stats, result) + 1)
+                    if on_result:
+                        on_result(chat_id, result)
+                finally:
+                    queue.task_done()
+
+        async def reporter():
+            while True:
+                await asyncio.sleep(PROGRESS_INTERVAL)
+                await _report(progress, stats)
+
+        tasks = [asyncio.create_task(worker()) for _ in range(self.workers)]
+        if progress:
+            tasks.append(asyncio.create_task(reporter()))
+        try:
+            async for chat_id in recipients:
+                if stop is not None and stop.is_set():
+                    break
+                await queue.put(chat_id)
+            await queue.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        await _report(progress, stats)
+        return stats
+
+
+STATUS_TEXT = {
+    "running": "📢 Идёт рассылка",
+    "paused": "⏸ Рассылка на паузе",
+    "cancelled": "❌ Рассылка отменена",
+    "done": "✅ Рассылка завершена!",
+}
+
+
+class BroadcastJobs:
+    """Рассылки как задания в БД.
+
+    У задания есть курсор (id, до которого все получатели обработаны) и
+    статус доставки по каждому получателю, поэтому после перезапуска оно
+    продолжается с места остановки и никому не шлёт повторно.
+
+    Выполняет задания только лидер (см. workers.Leader): остальные воркеры
+    лишь создают их и меняют статус в БД, а лидер подхватывает это в
+    resume_all и при очередном сохранении прогресса.
+    """
+
+    def __init__(self, bot, db, broadcaster, leader):
+        self.bot = bot
+        self.db = db
+        self.broadcaster = broadcaster
+        self.leader = leader
+        self._running = {}  # job_id -> (task, stop event)
+
+    async def start(self, text, segment="all", chat_id=None, message_id=None):
+        job_id = await self.db.create_broadcast_job(text, segment, chat_id, message_id)
+        if self.leader.is_leader:
+            self._spawn(job_id)
+        log.info(f"BROADCAST JOB #{job_id} started ({segment})")
+        return job_id
+
+    async def resume_all(self):
+        """Запускает незавершённые задания, которые ещё не идут в этом процессе"""
+        if not self.leader.is_leader:
+            return
+        for job in await self.db.get_broadcast_jobs(("running",), limit=100):
+            if job[0] not in self._running:
+                log.info(f"BROADCAST JOB #{job[0]} resumed from cursor {job[4]}")
+                self._spawn(job[0])
+
+    async def pause(self, job_id):
+        if await self.db.set_broadcast_status(job_id, "paused", only_from=("running",)):
+            await self._stop(job_id)
+        await self.render(job_id)
+
+    async def resume(self, job_id):
+        if await self.db.set_broadcast_status(job_id, "running", only_from=("paused",)):
+            await self.resume_all()
+
+    async def cancel(self, job_id):
+        if await self.db.set_broadcast_status(job_id, "cancelled", only_from=("running", "paused")):
+            await self._stop(job_id)
+        await self.render(job_id)
+
+    async def shutdown(self):
+        """Останавливает задания, не меняя статус: при следующем старте они продолжатся"""
+        await asyncio.gather(*(self._stop(job_id) for job_id in list(self._running)))
+
+    def _spawn(self, job_id):
+        if job_id in self._running:
+            return
+        stop = asyncio.Event()
+        task = asyncio.create_task(self._run(job_id, stop))
+        self._running[job_id] = (task, stop)
+        task.add_done_callback(lambda t: self._forget(job_id, t))
+
+    def _forget(self, job_id, task):
+        # Задание могли уже перезапустить — не выкидываем новую задачу
+        if self._running.get(job_id, (None,))[0] is task:
+            del self._running[job_id]
+
+    async def _stop(self, job_id):
+        running = self._running.get(job_id)
+        if running:
+            task, stop = running
+            stop.set()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self, job_id, stop):
+        _, text, segment, _, cursor, sent, failed, blocked, _, _ = await self.db.get_broadcast_job(job_id)
+        stats = BroadcastStats(sent, failed, blocked)
+        pending = {}  # отправляемые сейчас id в порядке возрастания (dict как упорядоченное множество)
+        results = []
+        last = {"id": cursor}
+
+        async def recipients():
+            async for chat_id in self.db.iter_recipients(
+                after_id=cursor, skip_job=job_id, batch_size=BATCH_SIZE, **SEGMENTS[segment]
+            ):
+                pending[chat_id] = None
+                last["id"] = chat_id
+                yield chat_id
+
+        def on_result(chat_id, result):
+            pending.pop(chat_id, None)
+            results.append((chat_id, result))
+
+        async def flush():
+            # Все id меньше самого раннего незавершённого уже обработаны
+            done_up_to = next(iter(pending)) - 1 if pending else last["id"]
+            batch = results[:]
+            results.clear()
+            await self.db.save_broadcast_progress(job_id, done_up_to, batch)
+
+        async def progress(_):
+            await flush()
+            # Паузу/отмену могли нажать в другом воркере, а лидерство — потеряться
+            job = await self.db.get_broadcast_job(job_id)
+            if job[3] != "running" or not self.leader.is_leader:
+                stop.set()
+            await self.render(job_id, stats)
+
+        try:
+            await self.broadcaster.run(text, recipients(), progress, stats, stop, on_result)
+        finally:
+            await flush()
+
+        if not stop.is_set():
+            await self.db.set_broadcast_status(job_id, "done", only_from=("running",))
+            log.info(f"BROADCAST JOB #{job_id} done -> sent={stats.sent} blocked={stats.blocked} failed={stats.failed}")
+        await self.render(job_id)
+
+    async def render(self, job_id, stats=None):
+        """Обновляет сообщение админа с прогрессом задания"""
+        job = await self.db.get_broadcast_job(job_id)
+        if not job or not job[8]:
+            return
+        _, _, _, status, _, sent, failed, blocked, chat_id, message_id = job
+        if stats is None:
+            stats = BroadcastStats(sent, failed, blocked)
+        await _report(
+            lambda s: self.bot.edit_message_text(
+                f"{STATUS_TEXT[status]} #{job_id}\n\n{s.format()}",
+                chat_id=chat_id,
+                message_id=message_id,
+                reply_markup=job_kb(job_id, status),
+            ),
+            stats,
+        )
+
+
+async def _report(progress, stats):
+    if not progress:
+        return
+    try:
+        await progress(stats)
+    except Exception as e:
+        # Прогресс — не повод ронять рассылку (например, "message is not modified")
+        log.debug(f"BROADCAST progress error -> {e}")
@@ -0,0 +1,72 @@
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+MAX_USERS = 50000
+
+
+def parse_ts(value):
+    """CURRENT_TIMESTAMP из SQLite (UTC, без зоны) -> unix-время"""
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+class Cooldown:
+    """Кэш "когда пользователю снова можно" для промо и тикетов.
+
+    При промахе значение берётся из БД через load(user_id) -> время последнего
+    действия или None, дальше всё решается в памяти. LRU ограничен MAX_USERS.
+    """
+
+    def __init__(self, period, load, maxsize=MAX_USERS):
+        self.period = period.total_seconds()
+        self._load = load
+        self._maxsize = maxsize
+        self._next = OrderedDict()  # user_id -> unix-время, с которого снова можно
+
+    async def remaining(self, user_id):
+        """Сколько секунд ещё ждать (0 — можно)"""
+        return max(await self._next_allowed(user_id) - time.time(), 0)
+
+    async def acquire(self, user_id):
+        """Проверяет и сразу занимает кулдаун. 0 — можно, иначе сколько ждать.
+
+        Между проверкой и записью нет await, поэтому два быстрых клика
+        подряд не пройдут оба.
+        """
+        left = await self.remaining(user_id)
+        if not left:
+            self.mark(user_id)
+        return left
+
+    def mark(self, user_id, when=None):
+        self._set(user_id, (when or time.time()) + self.period)
+
+    def release(self, user_id):
+        """Отменяет acquire, если действие в итоге не состоялось"""
+        self._next.pop(user_id, None)
+
+    async def _next_allowed(self, user_id):
+        if user_id in self._next:
+            self._next.move_to_end(user_id)
+            return self._next[user_id]
+        last = await self._load(user_id)
+        # Пока ждали БД, другой обработчик мог уже записать значение — оно новее
+        if user_id not in self._next:
+            self._set(user_id, parse_ts(last) + self.period if last else 0)
+        return self._next[user_id]
+
+    def _set(self, user_id, value):
+        self._next[user_id] = value
+        self._next.move_to_end(user_id)
+        while len(self._next) > self._maxsize:
+            self._next.popitem(last=False)
+
+
+def format_wait(seconds):
+    seconds = int(seconds) + 1
+    hours, minutes = seconds // 3600, seconds % 3600 // 60
+    if hours:
+        return f"{hours} ч {minutes} мин"
+    if minutes:
+        return f"{minutes} мин"
+    return f"{seconds} сек"
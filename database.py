@@ -1,157 +1,1038 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
 import aiosqlite
 from pathlib import Path
 
+from metrics import DB_ERRORS, DB_LATENCY, instrument
+
+log = logging.getLogger("bot")
+
 DB_PATH = Path("bot.db")
+WRITE_DELAY = 0.05  # write-behind: сколько секунд копим записи перед транзакцией
+WRITE_BATCH = 200  # ... или сколько строк, после которых пишем сразу
+TICKET_LOCK_TTL = 30 * 60  # секунды: взятый админом тикет освобождается, если он пропал
+
+PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",  # в WAL это безопасно и намного быстрее FULL
+    "PRAGMA cache_size=-16000",  # ~16 МБ
+    "PRAGMA mmap_size=67108864",  # 64 МБ
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+    "PRAGMA busy_timeout=5000",  # несколько воркеров: ждём чужую запись, а не падаем с SQLITE_BUSY
+]
+
+# Миграции схемы: индекс в списке + 1 = номер версии в PRAGMA user_version.
+# Новые изменения только дописываются в конец, старые не трогаем.
+MIGRATIONS = [
+    # 1: исходная схема
+    [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            telegram_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_promo TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS promo_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER,
+            promo_code TEXT,
+            issued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tickets (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER,
+            username TEXT,
+            first_name TEXT,
+            text TEXT,
+            status TEXT DEFAULT 'open',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            answered_at TIMESTAMP
+        )
+        """,
+    ],
+    # 2: индексы под историю промо, тикеты и рассылку новым игрокам
+    [
+        "CREATE INDEX IF NOT EXISTS idx_promo_history_user ON promo_history (telegram_id, issued_at)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_user ON tickets (telegram_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_status ON tickets (status, created_at)",
+    ],
+    # 3: пул промокодов (раньше жил в data/promocodes.json)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS promo_codes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            code TEXT NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL,
+            claimed_by INTEGER,
+            claimed_at TIMESTAMP
+        )
+        """,
+        # Частичный индекс только по свободным кодам: выдача не перебирает уже выданные
+        "CREATE INDEX IF NOT EXISTS idx_promo_codes_free ON promo_codes (id) WHERE claimed_by IS NULL",
+    ],
+    # 4: отметка о том, что пользователь заблокировал бота
+    [
+        "ALTER TABLE users ADD COLUMN blocked_at TIMESTAMP",
+    ],
+    # 5: рассылки как задания, которые переживают перезапуск
+    [
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            segment TEXT NOT NULL DEFAULT 'all',
+            status TEXT NOT NULL DEFAULT 'running',
+            cursor INTEGER,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            chat_id INTEGER,
+            message_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            job_id INTEGER NOT NULL,
+            telegram_id INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            PRIMARY KEY (job_id, telegram_id)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs (status)",
+    ],
+    # 6: история онлайна серверов: сырые замеры + часовые/дневные агрегаты
+    [
+        """
+        CREATE TABLE IF NOT EXISTS online_samples (
+            ts INTEGER NOT NULL,
+            server TEXT NOT NULL,
+            players INTEGER NOT NULL,
+            max_players INTEGER NOT NULL,
+            PRIMARY KEY (ts, server)
+        ) WITHOUT ROWID
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS online_rollups (
+            server TEXT NOT NULL,
+            resolution TEXT NOT NULL,
+            bucket INTEGER NOT NULL,
+            avg_players REAL NOT NULL,
+            peak_players INTEGER NOT NULL,
+            max_players INTEGER NOT NULL,
+            samples INTEGER NOT NULL,
+            PRIMARY KEY (server, resolution, bucket)
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 7: состояния FSM (админка, тикеты), чтобы они переживали перезапуск
+    [
+        """
+        CREATE TABLE IF NOT EXISTS fsm_states (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_at INTEGER NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 8: аренды для выбора одного воркера под фоновые задачи
+    [
+        """
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            owner TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 9: индексы под постраничные списки админки и поиск по username
+    [
+        # NOCASE — чтобы LIKE 'prefix%' (он регистронезависимый) шёл по индексу
+        "CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_tickets_status_id ON tickets (status, id)",
+    ],
+    # 10: счётчики статистики, которые ведут триггеры (дашборд читает их за O(1))
+    [
+        """
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+        """,
+        # Дневные значения: day — полночь UTC в unix-времени
+        """
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day INTEGER NOT NULL,
+            name TEXT NOT NULL,
+            value INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, name)
+        ) WITHOUT ROWID
+        """,
+        "ALTER TABLE users ADD COLUMN promo_count INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_users_promo_count ON users (promo_count)",
+        # Один раз досчитываем то, что накопилось до триггеров
+        """
+        UPDATE users
+        SET promo_count = (SELECT COUNT(*) FROM promo_history p WHERE p.telegram_id = users.telegram_id)
+        """,
+        """
+        INSERT INTO stats_counters (name, value)
+        SELECT 'users', COUNT(*) FROM users
+        UNION ALL SELECT 'promos', COUNT(*) FROM promo_history
+        UNION ALL SELECT 'tickets_open', COUNT(*) FROM tickets WHERE status = 'open'
+        UNION ALL SELECT 'tickets_closed', COUNT(*) FROM tickets WHERE status != 'open'
+        """,
+        """
+        INSERT INTO stats_daily (day, name, value)
+        SELECT CAST(strftime('%s', date(joined_at)) AS INTEGER), 'joins', COUNT(*) FROM users WHERE joined_at IS NOT NULL GROUP BY 1
+        UNION ALL
+        SELECT CAST(strftime('%s', date(issued_at)) AS INTEGER), 'promos', COUNT(*) FROM promo_history WHERE issued_at IS NOT NULL GROUP BY 1
+        UNION ALL
+        SELECT CAST(strftime('%s', date(created_at)) AS INTEGER), 'tickets', COUNT(*) FROM tickets WHERE created_at IS NOT NULL GROUP BY 1
+        UNION ALL
+        SELECT CAST(strftime('%s', date(answered_at)) AS INTEGER), 'answered', COUNT(*) FROM tickets WHERE answered_at IS NOT NULL GROUP BY 1
+        UNION ALL
+        SELECT CAST(strftime('%s', date(answered_at)) AS INTEGER), 'response_seconds',
+               CAST(SUM((julianday(answered_at) - julianday(created_at)) * 86400) AS INTEGER)
+        FROM tickets WHERE answered_at IS NOT NULL GROUP BY 1
+        """,
+        # Повторный /start (upsert) — это UPDATE, поэтому INSERT-триггер считает только новых
+        """
+        CREATE TRIGGER IF NOT EXISTS stats_users_insert AFTER INSERT ON users
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'users';
+            INSERT INTO stats_daily (day, name, value) VALUES (CAST(strftime('%s', date(NEW.joined_at)) AS INTEGER), 'joins', 1)
+                ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS stats_promos_insert AFTER INSERT ON promo_history
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'promos';
+            UPDATE users SET promo_count = promo_count + 1 WHERE telegram_id = NEW.telegram_id;
+            INSERT INTO stats_daily (day, name, value) VALUES (CAST(strftime('%s', date(NEW.issued_at)) AS INTEGER), 'promos', 1)
+                ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS stats_tickets_insert AFTER INSERT ON tickets
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'tickets_open';
+            INSERT INTO stats_daily (day, name, value) VALUES (CAST(strftime('%s', date(NEW.created_at)) AS INTEGER), 'tickets', 1)
+                ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS stats_tickets_close AFTER UPDATE OF status ON tickets
+        WHEN OLD.status = 'open' AND NEW.status != 'open'
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'tickets_open';
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'tickets_closed';
+            INSERT INTO stats_daily (day, name, value) VALUES (CAST(strftime('%s', date(NEW.answered_at)) AS INTEGER), 'answered', 1)
+                ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_daily (day, name, value) VALUES (
+                    CAST(strftime('%s', date(NEW.answered_at)) AS INTEGER), 'response_seconds',
+                    CAST((julianday(NEW.answered_at) - julianday(NEW.created_at)) * 86400 AS INTEGER)
+                )
+                ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+        END
+        """,
+    ],
+    # 11: переписка по тикетам, назначение админа и повторное открытие
+    [
+        """
+        CREATE TABLE IF NOT EXISTS ticket_messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket_id INTEGER NOT NULL,
+            sender_id INTEGER NOT NULL,
+            from_admin INTEGER NOT NULL,
+            text TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_ticket_messages_ticket ON ticket_messages (ticket_id, id)",
+        "ALTER TABLE tickets ADD COLUMN assigned_to INTEGER",
+        "ALTER TABLE tickets ADD COLUMN reopened_at TIMESTAMP",
+        # Время ответа на переоткрытый тикет считаем от переоткрытия, а не от создания
+        "DROP TRIGGER IF EXISTS stats_tickets_close",
+        """
+        CREATE TRIGGER IF NOT EXISTS stats_tickets_close AFTER UPDATE OF status ON tickets
+        WHEN OLD.status = 'open' AND NEW.status != 'open'
+        BEGIN
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'tickets_open';
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'tickets_closed';
+            INSERT INTO stats_daily (day, name, value) VALUES (CAST(strftime('%s', date(NEW.answered_at)) AS INTEGER), 'answered', 1)
+                ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+            INSERT INTO stats_daily (day, name, value) VALUES (
+                    CAST(strftime('%s', date(NEW.answered_at)) AS INTEGER), 'response_seconds',
+                    CAST((julianday(NEW.answered_at) - julianday(COALESCE(NEW.reopened_at, NEW.created_at))) * 86400 AS INTEGER)
+                )
+                ON CONFLICT (day, name) DO UPDATE SET value = value + excluded.value;
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS stats_tickets_reopen AFTER UPDATE OF status ON tickets
+        WHEN OLD.status != 'open' AND NEW.status = 'open'
+        BEGIN
+            UPDATE stats_counters SET value = value + 1 WHERE name = 'tickets_open';
+            UPDATE stats_counters SET value = value - 1 WHERE name = 'tickets_closed';
+        END
+        """,
+    ],
+    # 12: file_id загруженных в Telegram медиа (см. media.py)
+    [
+        """
+        CREATE TABLE IF NOT EXISTS media_cache (
+            key TEXT PRIMARY KEY,
+            digest TEXT NOT NULL,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+        """,
+    ],
+    # 13: сегменты рассылок — активность и привязка рейд-оповещений
+    [
+        "ALTER TABLE users ADD COLUMN last_seen TIMESTAMP",
+        "UPDATE users SET last_seen = COALESCE(last_promo, joined_at)",
+        "ALTER TABLE users ADD COLUMN raid_linked_at TIMESTAMP",
+    ],
+    # 14: когда тикет взят админом — закрепление истекает через ticket_lock_ttl
+    [
+        "ALTER TABLE tickets ADD COLUMN assigned_at TIMESTAMP",
+    ],
+]
 
+def _ts(dt):
+    """datetime -> строка в формате CURRENT_TIMESTAMP (UTC), чтобы сравнения в SQL работали"""
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+def _search(search, id_columns, username_column):
+    """Условие поиска для админки: число — точный id, иначе начало username"""
+    search = search.strip().lstrip("@#")
+    if search.isdigit():
+        return "(" + " OR ".join(f"{c} = ?" for c in id_columns) + ")", [int(search)] * len(id_columns)
+    pattern = search.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+    return f"{username_column} LIKE ? ESCAPE '\\'", [pattern]
+
+# Время каждого метода попадает в метрики; общие хелперы не считаем, чтобы не дублировать
+@instrument(DB_LATENCY, DB_ERRORS, exclude=("open", "close", "execute", "fetchone", "fetchall", "page", "flush"))
 class Database:
-    def __init__(self, path=DB_PATH):
+    def __init__(self, path=DB_PATH, write_delay=WRITE_DELAY, write_batch=WRITE_BATCH,
+                 ticket_lock_ttl=TICKET_LOCK_TTL):
         self.path = path
+        self.ticket_lock_ttl = ticket_lock_ttl
+        self.conn = None
+        # Одно соединение на весь процесс: пишем под локом, чтобы транзакции не перемешивались
+        self.write_lock = asyncio.Lock()
 
-    async def init(self):
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    telegram_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    last_promo TIMESTAMP
-                )
-            """)
+        # Write-behind для частых записей из обработчиков (add_user, update_last_promo,
+        # add_promo_history): копятся в памяти и пишутся пачкой одной транзакцией
+        self.write_delay = write_delay
+        self.write_batch = write_batch
+        self._new_users = {}  # telegram_id -> (username, first_name, joined_at)
+        self._seen = {}  # telegram_id -> last_seen
+        self._last_promos = {}  # telegram_id -> last_promo
+        self._history = []  # [(telegram_id, promo_code, issued_at)]
+        self._writing = set()  # telegram_id из пачки, которая сейчас пишется
+        self._wake = asyncio.Event()
+        self._writer = None
 
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS promo_history (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER,
-                    promo_code TEXT,
-                    issued_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
+    async def open(self):
+        if self.conn is None:
+            self.conn = await aiosqlite.connect(self.path)
 
-            await db.execute("""
-                CREATE TABLE IF NOT EXISTS tickets (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER,
-                    username TEXT,
-                    first_name TEXT,
-                    text TEXT,
-                    status TEXT DEFAULT 'open',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    answered_at TIMESTAMP
+    async def close(self):
+        if self._writer is not None:
+            self._writer.cancel()
+            await asyncio.gather(self._writer, return_exceptions=True)
+            self._writer = None
+        if self.conn is not None:
+            await self.flush()  # Дописываем всё, что накопилось
+            await self.conn.close()
+            self.conn = None
+
+    # ===== HELPERS =====
+    async def execute(self, sql, params=()):
+        async with self.write_lock:
+            cursor = await self.conn.execute(sql, params)
+            await self.conn.commit()
+            return cursor.lastrowid
+
+    async def fetchone(self, sql, params=()):
+        async with self.conn.execute(sql, params) as cursor:
+            return await cursor.fetchone()
+
+    async def fetchall(self, sql, params=()):
+        async with self.conn.execute(sql, params) as cursor:
+            return await cursor.fetchall()
+
+    # ===== WRITE-BEHIND =====
+    def _pending(self):
+        return len(self._new_users) + len(self._seen) + len(self._last_promos) + len(self._history)
+
+    def _queued(self):
+        """Запись поставлена в очередь: будим писателя, если набралась пачка"""
+        if self._pending() >= self.write_batch:
+            self._wake.set()
+        if self._writer is None:
+            self._writer = asyncio.create_task(self._write_loop())
+
+    def has_pending(self, telegram_id):
+        """Есть ли у пользователя записи, которых ещё нет в БД.
+
+        last_seen (touch_user) не считается: его не читают ни история, ни
+        блокировка, а отмечается он на каждом апдейте.
+        """
+        return (
+            telegram_id in self._new_users
+            or telegram_id in self._last_promos
+            or telegram_id in self._writing
+            or any(row[0] == telegram_id for row in self._history)
+        )
+
+    async def _write_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.write_delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                # shield: close() отменяет цикл, но начатая транзакция должна дописаться
+                await asyncio.shield(self.flush())
+            except Exception as e:
+                log.error(f"DB write-behind error -> {e}")
+
+    async def flush(self):
+        """Пишет накопленное одной транзакцией через executemany.
+
+        Пачка забирается под локом; пока её запросы идут по одному, чужое
+        чтение может вклиниться между ними и увидеть только часть пачки.
+        Поэтому id из пишущейся пачки лежат в _writing (см. has_pending),
+        и чтения своих данных сначала дожидаются flush.
+        Если транзакция упала, строки возвращаются в очередь.
+        """
+        async with self.write_lock:
+            users, seen, promos, history = self._new_users, self._seen, self._last_promos, self._history
+            if not (users or seen or promos or history):
+                return
+            self._new_users, self._seen, self._last_promos, self._history = {}, {}, {}, []
+            self._writing = {*users, *promos, *(row[0] for row in history)}
+            try:
+                # Повторный /start снимает отметку о блокировке
+                await self.conn.executemany("""
+                    INSERT INTO users (telegram_id, username, first_name, joined_at, last_seen)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT (telegram_id) DO UPDATE SET blocked_at = NULL
+                """, [
+                    (telegram_id, username, first_name, joined_at, joined_at)
+                    for telegram_id, (username, first_name, joined_at) in users.items()
+                ])
+                await self.conn.executemany(
+                    "UPDATE users SET last_seen = ? WHERE telegram_id = ?",
+                    [(last_seen, telegram_id) for telegram_id, last_seen in seen.items()],
                 )
-            """)
+                await self.conn.executemany(
+                    "UPDATE users SET last_promo = ? WHERE telegram_id = ?",
+                    [(last_promo, telegram_id) for telegram_id, last_promo in promos.items()],
+                )
+                await self.conn.executemany("""
+                    INSERT INTO promo_history (telegram_id, promo_code, issued_at)
+                    VALUES (?, ?, ?)
+                """, history)
+                await self.conn.commit()
+            except Exception:
+                await self.conn.rollback()
+                # Более новые значения, пришедшие за время записи, не затираем
+                self._new_users = {**users, **self._new_users}
+                self._seen = {**seen, **self._seen}
+                self._last_promos = {**promos, **self._last_promos}
+                self._history = history + self._history
+                raise
+            finally:
+                self._writing = set()
 
-            await db.commit()
+    async def page(self, select, key, conditions=(), params=(), after=None, before=None, limit=10):
+        """Keyset-страница: limit строк после after (или перед before) по возрастанию key.
+
+        Стоит O(limit) при любом размере таблицы, в отличие от OFFSET.
+        """
+        conditions, params = list(conditions), list(params)
+        if after is not None:
+            conditions.append(f"{key} > ?")
+            params.append(after)
+        if before is not None:
+            conditions.append(f"{key} < ?")
+            params.append(before)
+        where = " AND ".join(conditions) or "1"
+        order = "DESC" if before is not None else "ASC"
+        rows = await self.fetchall(f"{select} WHERE {where} ORDER BY {key} {order} LIMIT ?", (*params, limit))
+        return rows[::-1] if before is not None else rows
+
+    async def init(self):
+        await self.open()
+        for pragma in PRAGMAS:
+            await self.conn.execute(pragma)
+
+        # Каждая миграция вместе с user_version — одна транзакция (DDL в SQLite
+        # транзакционный): упавшая посередине откатывается целиком и при
+        # следующем старте выполняется заново. IMMEDIATE сразу берёт запись,
+        # так что воркеры, стартующие одновременно, не накатят одно и то же дважды.
+        async with self.write_lock:
+            while True:
+                await self.conn.execute("BEGIN IMMEDIATE")
+                try:
+                    version = (await self.fetchone("PRAGMA user_version"))[0]
+                    if version >= len(MIGRATIONS):
+                        await self.conn.commit()
+                        break
+                    for sql in MIGRATIONS[version]:
+                        await self.conn.execute(sql)
+                    # PRAGMA не принимает параметры, номер подставляем сами
+                    await self.conn.execute(f"PRAGMA user_version = {version + 1}")
+                    await self.conn.commit()
+                except BaseException:
+                    await self.conn.rollback()
+                    raise
 
     # ===== USERS =====
     async def add_user(self, telegram_id, username, first_name):
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute("""
-                INSERT OR IGNORE INTO users (telegram_id, username, first_name)
-                VALUES (?, ?, ?)
-            """, (telegram_id, username, first_name))
-            await db.commit()
+        """Write-behind: в БД попадёт со следующей пачкой"""
+        self._new_users.setdefault(telegram_id, (username, first_name, _ts(datetime.now(timezone.utc))))
+        self._queued()
 
-    # В database.py
-    async def get_last_ticket(self, telegram_id):
-        async with aiosqlite.connect(self.path) as db:
-            cursor = await db.execute("""
-                SELECT created_at FROM tickets
-                WHERE telegram_id = ?
-                ORDER BY created_at DESC
-                LIMIT 1
-            """, (telegram_id,))
-            row = await cursor.fetchone()
-            return row[0] if row else None
-    
-    async def update_last_promo(self, telegram_id):
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute("""
+    async def touch_user(self, telegram_id):
+        """Отметка активности для сегментов рассылки. Write-behind: за пачку одна запись на пользователя"""
+        self._seen[telegram_id] = _ts(datetime.now(timezone.utc))
+        self._queued()
+
+    async def set_raid_linked(self, telegram_id):
+        """Пользователь привязал рейд-оповещения. False — такого пользователя нет"""
+        async with self.write_lock:
+            cursor = await self.conn.execute("""
                 UPDATE users
-                SET last_promo = CURRENT_TIMESTAMP
+                SET raid_linked_at = COALESCE(raid_linked_at, CURRENT_TIMESTAMP)
                 WHERE telegram_id = ?
             """, (telegram_id,))
-            await db.commit()
+            await self.conn.commit()
+            return cursor.rowcount > 0
+
+    async def mark_blocked(self, telegram_id):
+        # Сначала отложенный /start, иначе он снимет только что поставленную отметку
+        if self.has_pending(telegram_id):
+            await self.flush()
+        await self.execute("""
+            UPDATE users
+            SET blocked_at = CURRENT_TIMESTAMP
+            WHERE telegram_id = ?
+        """, (telegram_id,))
+
+    # В database.py
+    async def get_last_ticket(self, telegram_id):
+        row = await self.fetchone("""
+            SELECT created_at FROM tickets
+            WHERE telegram_id = ?
+            ORDER BY created_at DESC
+            LIMIT 1
+        """, (telegram_id,))
+        return row[0] if row else None
+
+    async def update_last_promo(self, telegram_id):
+        """Write-behind: в БД попадёт со следующей пачкой"""
+        self._last_promos[telegram_id] = _ts(datetime.now(timezone.utc))
+        self._queued()
 
     async def get_last_promo(self, telegram_id):
-        async with aiosqlite.connect(self.path) as db:
-            cursor = await db.execute("""
-                SELECT last_promo FROM users
-                WHERE telegram_id = ?
-            """, (telegram_id,))
-            row = await cursor.fetchone()
-            return row[0] if row else None
-
-    async def count_users(self):
-        async with aiosqlite.connect(self.path) as db:
-            cursor = await db.execute("SELECT COUNT(*) FROM users")
-            return (await cursor.fetchone())[0]
-
-    async def get_all_user_ids(self):
-        async with aiosqlite.connect(self.path) as db:
-            cursor = await db.execute("SELECT telegram_id FROM users")
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]
-
-    async def get_users_without_promos(self):
-        async with aiosqlite.connect(self.path) as db:
-            cursor = await db.execute("""
+        if telegram_id in self._last_promos:
+            return self._last_promos[telegram_id]
+        # Значение может быть в пачке, которая пишется прямо сейчас
+        if telegram_id in self._writing:
+            await self.flush()
+        row = await self.fetchone("""
+            SELECT last_promo FROM users
+            WHERE telegram_id = ?
+        """, (telegram_id,))
+        return row[0] if row else None
+
+    async def count_users(self, search=None):
+        if not search:
+            return await self.get_counter("users")
+        where, params = _search(search, ["telegram_id"], "username")
+        return (await self.fetchone(f"SELECT COUNT(*) FROM users WHERE {where}", params))[0]
+
+    async def get_users_page(self, after=None, before=None, search=None, limit=10):
+        """Страница пользователей: (telegram_id, first_name, username, blocked_at)"""
+        conditions, params = [], []
+        if search:
+            where, params = _search(search, ["telegram_id"], "username")
+            conditions.append(where)
+        return await self.page(
+            "SELECT telegram_id, first_name, username, blocked_at FROM users",
+            "telegram_id", conditions, params, after, before, limit,
+        )
+
+    async def get_top_users(self, limit=5):
+        """Самые активные по числу промо: (first_name, username, promo_count), по индексу"""
+        return await self.fetchall("""
+            SELECT first_name, username, promo_count
+            FROM users
+            WHERE promo_count > 0
+            ORDER BY promo_count DESC
+            LIMIT ?
+        """, (limit,))
+
+    async def iter_recipients(self, without_promos=False, active_days=None, raid_linked=False,
+                              include_blocked=False, after_id=None, skip_job=None, batch_size=500):
+        """Id получателей рассылки пачками по batch_size (keyset по первичному ключу).
+
+        Весь список в память не грузится: в любой момент держим одну пачку.
+        Фильтры сегмента: without_promos — ещё не получали промо, active_days —
+        заходили в бота за последние N дней, raid_linked — привязали
+        рейд-оповещения. Заблокировавшие бота пропускаются, если не
+        include_blocked. after_id — начать после этого id, skip_job —
+        пропустить тех, кому задание рассылки уже что-то отправило.
+        """
+        conditions, params = [], []
+        if not include_blocked:
+            conditions.append("u.blocked_at IS NULL")
+        if without_promos:
+            conditions.append("NOT EXISTS (SELECT 1 FROM promo_history p WHERE p.telegram_id = u.telegram_id)")
+        if active_days is not None:
+            conditions.append("u.last_seen >= ?")
+            params.append(_ts(datetime.now(timezone.utc) - timedelta(days=active_days)))
+        if raid_linked:
+            conditions.append("u.raid_linked_at IS NOT NULL")
+        if skip_job is not None:
+            conditions.append("""NOT EXISTS (
+                SELECT 1 FROM broadcast_deliveries d
+                WHERE d.job_id = ? AND d.telegram_id = u.telegram_id
+            )""")
+            params.append(skip_job)
+        where = " AND ".join(conditions) or "1"
+
+        await self.flush()  # Только что подписавшиеся тоже получатели
+        last_id = after_id if after_id is not None else -2**63
+        while True:
+            rows = await self.fetchall(f"""
                 SELECT u.telegram_id
                 FROM users u
-                LEFT JOIN promo_history p ON u.telegram_id = p.telegram_id
-                WHERE p.telegram_id IS NULL
-            """)
-            rows = await cursor.fetchall()
-            return [row[0] for row in rows]
+                WHERE u.telegram_id > ? AND {where}
+                ORDER BY u.telegram_id
+                LIMIT ?
+            """, (last_id, *params, batch_size))
+            for row in rows:
+                yield row[0]
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
 
     # ===== PROMO =====
     async def add_promo_history(self, telegram_id, code):
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute("""
-                INSERT INTO promo_history (telegram_id, promo_code)
-                VALUES (?, ?)
-            """, (telegram_id, code))
-            await db.commit()
+        """Write-behind: в БД попадёт со следующей пачкой"""
+        self._history.append((telegram_id, code, _ts(datetime.now(timezone.utc))))
+        self._queued()
 
     async def get_user_history(self, telegram_id):
-        async with aiosqlite.connect(self.path) as db:
-            cursor = await db.execute("""
-                SELECT promo_code, issued_at
-                FROM promo_history
-                WHERE telegram_id = ?
-                ORDER BY issued_at DESC
-            """, (telegram_id,))
-            return await cursor.fetchall()
+        # Пользователь должен видеть свой только что выданный код
+        if self.has_pending(telegram_id):
+            await self.flush()
+        return await self.fetchall("""
+            SELECT promo_code, issued_at
+            FROM promo_history
+            WHERE telegram_id = ?
+            ORDER BY issued_at DESC
+        """, (telegram_id,))
+
+    # ===== PROMO CODES =====
+    async def add_promo(self, code, expires_days, created_at=None):
+        """Добавляет код в пул. False, если такой код уже есть"""
+        created_at = created_at or datetime.now(timezone.utc)
+        expires_at = created_at + timedelta(days=expires_days)
+        async with self.write_lock:
+            cursor = await self.conn.execute("""
+                INSERT OR IGNORE INTO promo_codes (code, created_at, expires_at)
+                VALUES (?, ?, ?)
+            """, (code, _ts(created_at), _ts(expires_at)))
+            await self.conn.commit()
+            return cursor.rowcount > 0
+
+    async def claim_promo(self, telegram_id):
+        """Атомарно выдаёт случайный свободный непросроченный код (или None).
+
+        Берём случайный id и ищем первый свободный код начиная с него по
+        частичному индексу, а если справа ничего нет — слева. Выбор и пометка
+        идут одним UPDATE, поэтому один код не может уйти двум игрокам.
+        """
+        # Два отдельных подзапроса: MIN и MAX в одном SELECT не дают SQLite взять
+        # концы индекса за O(log n), и он сканирует все свободные коды
+        bounds = await self.fetchone("""
+            SELECT
+                (SELECT MIN(id) FROM promo_codes WHERE claimed_by IS NULL),
+                (SELECT MAX(id) FROM promo_codes WHERE claimed_by IS NULL)
+        """)
+        if bounds[0] is None:
+            return None
+        pivot = random.randint(bounds[0], bounds[1])
 
-    async def count_total_promos(self):
-        async with aiosqlite.connect(self.path) as db:
-            cursor = await db.execute("SELECT COUNT(*) FROM promo_history")
-            return (await cursor.fetchone())[0]
+        async with self.write_lock:
+            for condition in ("id >= ?", "id < ?"):
+                cursor = await self.conn.execute(f"""
+                    UPDATE promo_codes
+                    SET claimed_by = ?, claimed_at = CURRENT_TIMESTAMP
+                    WHERE id = (
+                        SELECT id FROM promo_codes
+                        WHERE claimed_by IS NULL AND {condition} AND expires_at > CURRENT_TIMESTAMP
+                        ORDER BY id
+                        LIMIT 1
+                    )
+                    RETURNING code
+                """, (telegram_id, pivot))
+                row = await cursor.fetchone()
+                await cursor.close()
+                await self.conn.commit()
+                if row:
+                    return row[0]
+        return None
+
+    async def count_promos(self):
+        return (await self.fetchone("""
+            SELECT COUNT(*) FROM promo_codes
+            WHERE claimed_by IS NULL AND expires_at > CURRENT_TIMESTAMP
+        """))[0]
+
+    async def get_promos_page(self, after=None, before=None, limit=10):
+        """Страница свободных кодов: (id, code, expires_at)"""
+        return await self.page(
+            "SELECT id, code, expires_at FROM promo_codes",
+            "id", ["claimed_by IS NULL", "expires_at > CURRENT_TIMESTAMP"], (), after, before, limit,
+        )
+
+    async def get_promo(self, promo_id):
+        return await self.fetchone("SELECT id, code, expires_at FROM promo_codes WHERE id = ?", (promo_id,))
+
+    async def delete_promo(self, promo_id):
+        async with self.write_lock:
+            cursor = await self.conn.execute(
+                "DELETE FROM promo_codes WHERE id = ? AND claimed_by IS NULL", (promo_id,)
+            )
+            await self.conn.commit()
+            return cursor.rowcount > 0
+
+    async def delete_expired_promos(self):
+        async with self.write_lock:
+            cursor = await self.conn.execute("""
+                DELETE FROM promo_codes
+                WHERE claimed_by IS NULL AND expires_at <= CURRENT_TIMESTAMP
+            """)
+            await self.conn.commit()
+            return cursor.rowcount
 
     # ===== TICKETS =====
     async def add_ticket(self, telegram_id, username, first_name, text):
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute("""
-                INSERT INTO tickets (telegram_id, username, first_name, text)
+        """Создаёт тикет и возвращает его id"""
+        return await self.execute("""
+            INSERT INTO tickets (telegram_id, username, first_name, text)
+            VALUES (?, ?, ?, ?)
+        """, (telegram_id, username, first_name, text))
+
+    def _lock_expired_before(self):
+        return _ts(datetime.now(timezone.utc) - timedelta(seconds=self.ticket_lock_ttl))
+
+    async def get_ticket(self, ticket_id):
+        """(id, telegram_id, username, first_name, text, status, assigned_to) или None.
+
+        assigned_to — None, если закрепление истекло.
+        """
+        return await self.fetchone("""
+            SELECT id, telegram_id, username, first_name, text, status,
+                   CASE WHEN assigned_at > ? THEN assigned_to END
+            FROM tickets
+            WHERE id = ?
+        """, (self._lock_expired_before(), ticket_id))
+
+    async def count_open_tickets(self, search=None):
+        if not search:
+            return await self.get_counter("tickets_open")
+        where, params = _search(search, ["id", "telegram_id"], "username")
+        return (await self.fetchone(f"SELECT COUNT(*) FROM tickets WHERE status = 'open' AND {where}", params))[0]
+
+    async def get_tickets_page(self, after=None, before=None, search=None, limit=10):
+        """Страница открытых тикетов: (id, telegram_id, username, first_name, text)"""
+        conditions, params = ["status = 'open'"], []
+        if search:
+            where, params = _search(search, ["id", "telegram_id"], "username")
+            conditions.append(where)
+        return await self.page(
+            "SELECT id, telegram_id, username, first_name, text FROM tickets",
+            "id", conditions, params, after, before, limit,
+        )
+
+    async def _update_ticket(self, sql, params):
+        async with self.write_lock:
+            cursor = await self.conn.execute(sql, params)
+            await self.conn.commit()
+            return cursor.rowcount > 0
+
+    async def close_ticket(self, ticket_id):
+        """Закрывает тикет, если он ещё открыт. True — закрыл именно этот вызов"""
+        return await self._update_ticket("""
+            UPDATE tickets
+            SET status = 'closed', answered_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'open'
+        """, (ticket_id,))
+
+    async def assign_ticket(self, ticket_id, admin_id):
+        """Назначает открытый тикет админу, если его никто не держит (или держит он сам).
+
+        Повторное назначение тем же админом продлевает закрепление.
+        """
+        return await self._update_ticket("""
+            UPDATE tickets
+            SET assigned_to = ?, assigned_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status = 'open'
+              AND (assigned_to IS NULL OR assigned_to = ? OR assigned_at IS NULL OR assigned_at <= ?)
+        """, (admin_id, ticket_id, admin_id, self._lock_expired_before()))
+
+    async def release_ticket(self, ticket_id, admin_id):
+        """Снимает закрепление тикета за admin_id. True — снял этот вызов"""
+        return await self._update_ticket("""
+            UPDATE tickets
+            SET assigned_to = NULL, assigned_at = NULL
+            WHERE id = ? AND assigned_to = ?
+        """, (ticket_id, admin_id))
+
+    async def reopen_ticket(self, ticket_id, telegram_id):
+        """Открывает закрытый тикет заново, когда игрок отвечает в переписке"""
+        return await self._update_ticket("""
+            UPDATE tickets
+            SET status = 'open', reopened_at = CURRENT_TIMESTAMP, answered_at = NULL
+            WHERE id = ? AND telegram_id = ? AND status != 'open'
+        """, (ticket_id, telegram_id))
+
+    async def add_ticket_message(self, ticket_id, sender_id, from_admin, text):
+        await self.execute("""
+            INSERT INTO ticket_messages (ticket_id, sender_id, from_admin, text)
+            VALUES (?, ?, ?, ?)
+        """, (ticket_id, sender_id, int(from_admin), text))
+
+    async def get_ticket_messages(self, ticket_id, limit=10):
+        """Последние сообщения переписки по тикету: (from_admin, text, created_at), старые первыми"""
+        rows = await self.fetchall("""
+            SELECT from_admin, text, created_at
+            FROM ticket_messages
+            WHERE ticket_id = ?
+            ORDER BY id DESC
+            LIMIT ?
+        """, (ticket_id, limit))
+        return rows[::-1]
+
+    # ===== MEDIA =====
+    async def get_media(self, key):
+        """(digest, file_id) или None"""
+        return await self.fetchone("SELECT digest, file_id FROM media_cache WHERE key = ?", (key,))
+
+    async def set_media(self, key, digest, file_id):
+        await self.execute("""
+            INSERT INTO media_cache (key, digest, file_id)
+            VALUES (?, ?, ?)
+            ON CONFLICT (key) DO UPDATE SET
+                digest = excluded.digest, file_id = excluded.file_id, updated_at = CURRENT_TIMESTAMP
+        """, (key, digest, file_id))
+
+    async def delete_media(self, key):
+        await self.execute("DELETE FROM media_cache WHERE key = ?", (key,))
+
+    # ===== STATS =====
+    async def get_counter(self, name):
+        row = await self.fetchone("SELECT value FROM stats_counters WHERE name = ?", (name,))
+        return row[0] if row else 0
+
+    async def get_counters(self):
+        return dict(await self.fetchall("SELECT name, value FROM stats_counters"))
+
+    async def get_daily_stats(self, since):
+        """Дневные счётчики с полуночи UTC since: (name, day, value)"""
+        return await self.fetchall("SELECT name, day, value FROM stats_daily WHERE day >= ?", (since,))
+
+    # ===== BROADCAST JOBS =====
+    async def create_broadcast_job(self, text, segment="all", chat_id=None, message_id=None):
+        return await self.execute("""
+            INSERT INTO broadcast_jobs (text, segment, chat_id, message_id)
+            VALUES (?, ?, ?, ?)
+        """, (text, segment, chat_id, message_id))
+
+    async def get_broadcast_job(self, job_id):
+        """(id, text, segment, status, cursor, sent, failed, blocked, chat_id, message_id)"""
+        return await self.fetchone("""
+            SELECT id, text, segment, status, cursor, sent, failed, blocked, chat_id, message_id
+            FROM broadcast_jobs
+            WHERE id = ?
+        """, (job_id,))
+
+    async def get_broadcast_jobs(self, statuses=None, limit=10):
+        """Последние задания, тот же формат строк, что и в get_broadcast_job"""
+        sql = """
+            SELECT id, text, segment, status, cursor, sent, failed, blocked, chat_id, message_id
+            FROM broadcast_jobs
+        """
+        params = []
+        if statuses:
+            sql += f" WHERE status IN ({', '.join('?' * len(statuses))})"
+            params.extend(statuses)
+        sql += " ORDER BY id DESC LIMIT ?"
+        return await self.fetchall(sql, (*params, limit))
+
+    async def set_broadcast_status(self, job_id, status, only_from=None):
+        """Меняет статус задания. only_from — из каких статусов можно перейти"""
+        sql = """
+            UPDATE broadcast_jobs
+            SET status = ?,
+                finished_at = CASE WHEN ? IN ('done', 'cancelled') THEN CURRENT_TIMESTAMP END
+            WHERE id = ?
+        """
+        params = [status, status, job_id]
+        if only_from:
+            sql += f" AND status IN ({', '.join('?' * len(only_from))})"
+            params.extend(only_from)
+        async with self.write_lock:
+            cursor = await self.conn.execute(sql, params)
+            await self.conn.commit()
+            return cursor.rowcount > 0
+
+    async def save_broadcast_progress(self, job_id, cursor, deliveries):
+        """Одной транзакцией: статусы доставки [(telegram_id, status)], курсор и счётчики"""
+        counts = {"sent": 0, "failed": 0, "blocked": 0}
+        for _, status in deliveries:
+            counts[status] += 1
+        async with self.write_lock:
+            await self.conn.executemany("""
+                INSERT OR REPLACE INTO broadcast_deliveries (job_id, telegram_id, status)
+                VALUES (?, ?, ?)
+            """, [(job_id, telegram_id, status) for telegram_id, status in deliveries])
+            await self.conn.execute("""
+                UPDATE broadcast_jobs
+                SET cursor = COALESCE(?, cursor),
+                    sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+                WHERE id = ?
+            """, (cursor, counts["sent"], counts["failed"], counts["blocked"], job_id))
+            await self.conn.commit()
+
+    # ===== ONLINE HISTORY =====
+    async def add_online_samples(self, ts, samples):
+        """samples: [(server, players, max_players)], ts — unix-время замера"""
+        async with self.write_lock:
+            await self.conn.executemany("""
+                INSERT OR REPLACE INTO online_samples (ts, server, players, max_players)
                 VALUES (?, ?, ?, ?)
-            """, (telegram_id, username, first_name, text))
-            await db.commit()
-
-    async def get_open_tickets(self):
-        async with aiosqlite.connect(self.path) as db:
-            cursor = await db.execute("""
-                SELECT id, telegram_id, username, first_name, text
-                FROM tickets
-                WHERE status='open'
-                ORDER BY created_at ASC
-            """)
-            return await cursor.fetchall()
+            """, [(ts, *sample) for sample in samples])
+            await self.conn.commit()
+
+    async def rollup_online(self, now, utc_offset, raw_days, hourly_days, daily_days):
+        """Сворачивает замеры в часовые агрегаты, часы — в дни, и чистит старое.
+
+        Пересчитываются только часы/дни начиная с последнего агрегата, так что
+        работа не растёт с объёмом истории. utc_offset — сдвиг часового пояса
+        в секундах, чтобы сутки резались по местному времени.
+        """
+        hour_start = now // 3600 * 3600
+        day_start = (now + utc_offset) // 86400 * 86400 - utc_offset
+        async with self.write_lock:
+            last_hour = (await self.fetchone(
+                "SELECT MAX(bucket) FROM online_rollups WHERE resolution = 'hour'"
+            ))[0] or 0
+            await self.conn.execute("""
+                INSERT OR REPLACE INTO online_rollups
+                    (server, resolution, bucket, avg_players, peak_players, max_players, samples)
+                SELECT server, 'hour', ts / 3600 * 3600, AVG(players), MAX(players), MAX(max_players), COUNT(*)
+                FROM online_samples
+                WHERE ts >= ? AND ts < ?
+                GROUP BY server, ts / 3600
+            """, (last_hour, hour_start))
+
+            last_day = (await self.fetchone(
+                "SELECT MAX(bucket) FROM online_rollups WHERE resolution = 'day'"
+            ))[0] or 0
+            await self.conn.execute("""
+                INSERT OR REPLACE INTO online_rollups
+                    (server, resolution, bucket, avg_players, peak_players, max_players, samples)
+                SELECT server, 'day', (bucket + ?) / 86400 * 86400 - ?,
+                       SUM(avg_players * samples) / SUM(samples), MAX(peak_players), MAX(max_players), SUM(samples)
+                FROM online_rollups
+                WHERE resolution = 'hour' AND bucket >= ? AND bucket < ?
+                GROUP BY server, (bucket + ?) / 86400
+            """, (utc_offset, utc_offset, last_day, day_start, utc_offset))
+
+            await self.conn.execute("DELETE FROM online_samples WHERE ts < ?", (now - raw_days * 86400,))
+            await self.conn.execute(
+                "DELETE FROM online_rollups WHERE resolution = 'hour' AND bucket < ?",
+                (now - hourly_days * 86400,)
+            )
+            await self.conn.execute(
+                "DELETE FROM online_rollups WHERE resolution = 'day' AND bucket < ?",
+                (now - daily_days * 86400,)
+            )
+            await self.conn.commit()
+
+    async def get_online_rollups(self, server, resolution, since):
+        """[(bucket, avg_players, peak_players, max_players)] по возрастанию времени"""
+        return await self.fetchall("""
+            SELECT bucket, avg_players, peak_players, max_players
+            FROM online_rollups
+            WHERE server = ? AND resolution = ? AND bucket >= ?
+            ORDER BY bucket
+        """, (server, resolution, since))
+
+    # ===== FSM =====
+    async def load_fsm_states(self, since):
+        """Удаляет состояния старше since и возвращает остальные:
+        [(key, state, data json, updated_at)]"""
+        await self.execute("DELETE FROM fsm_states WHERE updated_at < ?", (since,))
+        return await self.fetchall("SELECT key, state, data, updated_at FROM fsm_states")
+
+    async def save_fsm_states(self, upserts, deletes):
+        """Одной транзакцией: upserts [(key, state, data json, updated_at)] и deletes [(key, updated_at)].
+
+        Удаляется только строка не новее updated_at: более свежую мог записать другой воркер.
+        """
+        async with self.write_lock:
+            await self.conn.executemany("""
+                INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at)
+                VALUES (?, ?, ?, ?)
+            """, upserts)
+            await self.conn.executemany("DELETE FROM fsm_states WHERE key = ? AND updated_at <= ?", deletes)
+            await self.conn.commit()
+
+    # ===== LEASES =====
+    async def acquire_lease(self, name, owner, ttl):
+        """Берёт или продлевает аренду name на ttl секунд. True — аренда у owner.
+
+        Один UPDATE/INSERT: чужую живую аренду перехватить нельзя, просроченную — можно.
+        """
+        now = time.time()
+        async with self.write_lock:
+            await self.conn.execute("""
+                INSERT INTO leases (name, owner, expires_at)
+                VALUES (?, ?, ?)
+                ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            """, (name, owner, now + ttl, now))
+            await self.conn.commit()
+        row = await self.fetchone("SELECT owner FROM leases WHERE name = ?", (name,))
+        return row is not None and row[0] == owner
 
-    async def answer_ticket(self, ticket_id):
-        async with aiosqlite.connect(self.path) as db:
-            await db.execute("""
-                UPDATE tickets
-                SET status='closed', answered_at=CURRENT_TIMESTAMP
-                WHERE id=?
-            """, (ticket_id,))
-            await db.commit()
+    async def release_lease(self, name, owner):
+        await self.execute("DELETE FROM leases WHERE name = ? AND owner = ?", (name, owner))
@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+import time
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage
+
+log = logging.getLogger("bot")
+
+FLUSH_INTERVAL = 1.0  # секунды между пачками записей в БД
+STATE_TTL = 24 * 3600  # незаконченный диалог старше суток считается брошенным
+
+
+def _key(key):
+    return ":".join(
+        str(part if part is not None else "")
+        for part in (key.bot_id, key.chat_id, key.user_id, key.thread_id, key.business_connection_id, key.destiny)
+    )
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище поверх нашей SQLite.
+
+    Все состояния держатся в памяти (их немного — это только незаконченные
+    диалоги), так что чтение не ходит в БД. Изменения копятся и раз в
+    FLUSH_INTERVAL пишутся одной транзакцией. Состояния, не менявшиеся
+    STATE_TTL секунд, выбрасываются.
+    """
+
+    def __init__(self, db, ttl=STATE_TTL, flush_interval=FLUSH_INTERVAL):
+        self.db = db
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self._states = {}  # key -> (state, data, updated_at)
+        self._dirty = set()
+        self._task = None
+
+    async def start(self):
+        """Загружает сохранённые состояния и запускает фоновую запись"""
+        for key, state, data, updated_at in await self.db.load_fsm_states(time.time() - self.ttl):
+            self._states[key] = (state, json.loads(data), updated_at)
+        if self._states:
+            log.info(f"FSM restored {len(self._states)} states")
+        self._task = asyncio.create_task(self._flush_loop())
+
+    def _get(self, key):
+        entry = self._states.get(key)
+        if entry is None or entry[2] < time.time() - self.ttl:
+            return None, {}
+        return entry[0], entry[1]
+
+    def _put(self, key, state, data):
+        self._states[key] = (state, data, time.time())
+        self._dirty.add(key)
+
+    async def set_state(self, key, state=None):
+        key = _key(key)
+        _, data = self._get(key)
+        self._put(key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key):
+        return self._get(_key(key))[0]
+
+    async def set_data(self, key, data):
+        key = _key(key)
+        state, _ = self._get(key)
+        self._put(key, state, dict(data))
+
+    async def get_data(self, key):
+        return dict(self._get(_key(key))[1])
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error(f"FSM flush error -> {e}")
+
+    async def flush(self):
+        expired_before = time.time() - self.ttl
+        expired = [k for k, entry in self._states.items() if entry[2] < expired_before]
+        for key in expired:
+            del self._states[key]
+            self._dirty.discard(key)
+        # Удаление условное (key, не новее чем): в памяти могут лежать давно
+        # загруженные чужие состояния, а другой воркер мог уже обновить их в БД
+        deletes = [(key, expired_before) for key in expired]
+
+        dirty, self._dirty = self._dirty, set()
+        upserts = []
+        for key in dirty:
+            state, data, updated_at = self._states.get(key, (None, {}, 0))
+            if state is None and not data:
+                # Пустое состояние (state.clear()) хранить незачем
+                self._states.pop(key, None)
+                deletes.append((key, updated_at))
+            else:
+                upserts.append((key, state, json.dumps(data, ensure_ascii=False), updated_at))
+        if not upserts and not deletes:
+            return
+        try:
+            await self.db.save_fsm_states(upserts, deletes)
+        except Exception:
+            self._dirty |= dirty  # не потеряем изменения, запишем в следующий раз
+            raise
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            await self.flush()
@@ -0,0 +1,220 @@
+from functools import lru_cache
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+SHOP_URL = "http://hostilerust.gamestores.app/"
+MAX_VARIANTS = 4096  # сколько вариантов с параметрами (имя, id тикета...) держим в LRU
+
+
+class CB:
+    """callback_data всех кнопок: обработчики и клавиатуры берут строки только отсюда"""
+
+    # Меню игрока
+    PROMO = "promo"
+    HISTORY = "history"
+    INFO = "info"
+    SERVERS = "servers"
+    WIPE = "wipe"
+    LINK_RAID = "link_raid"
+    ASK_QUESTION = "ask_question"
+    IPS = "ips"
+    ONLINE_CHART = "online_chart"
+    BACK_MAIN = "back_main"
+
+    # Админка
+    ADD_PROMO = "a_add"
+    DEL_PROMO = "a_del"
+    LIST_PROMOS = "a_list"
+    LIST_USERS = "a_users"
+    STATS = "a_stats"
+    LIST_TICKETS = "a_tickets"
+    BROADCAST = "a_bc"
+    BROADCAST_JOBS = "a_jobs"
+    ADMIN_EXIT = "admin_exit"
+    ADMIN_BACK = "admin_back"
+
+    # Рассылка
+    BC_SEND_ALL = "bc_send_all"
+    BC_SEND_NEW = "bc_send_new"
+    BC_SEND_ACTIVE = "bc_send_active"
+    BC_SEND_RAID = "bc_send_raid"
+    BC_CANCEL = "bc_cancel"
+
+    # Префиксы: дальше идёт параметр (id, действие, название списка)
+    DELPROMO_CONFIRM = "delpromo_confirm_"
+    DELPROMO_YES = "delpromo_yes_"
+    TICKET_ANSWER = "ticket_answer_"
+    TICKET_TAKE = "ticket_take_"
+    TICKET_CLOSE = "ticket_close_"
+    TICKET_RELEASE = "ticket_release_"
+    TICKET_REPLY = "ticket_reply_"
+    BCJOB = "bcjob_"
+    SEARCH = "search_"
+    CLEAR_SEARCH = "clear_search_"
+
+
+# ===== STATIC =====
+# Собираются один раз при импорте и отдаются всем; менять их на месте нельзя
+
+def _main_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="🎁 Получить промокод", callback_data=CB.PROMO)
+    kb.button(text="📜 Моя история промокодов", callback_data=CB.HISTORY)
+    kb.button(text="🛒 Пополнить баланс", url=SHOP_URL)
+    kb.button(text="❓ Информация", callback_data=CB.INFO)
+    kb.button(text="🎮 Онлайн серверов", callback_data=CB.SERVERS)
+    kb.button(text="⏳ До вайпа", callback_data=CB.WIPE)
+    kb.button(text="🔗 Оповещения о рейде", callback_data=CB.LINK_RAID)
+    kb.button(text="📝 Задать вопрос", callback_data=CB.ASK_QUESTION)
+    kb.button(text="📋 IP серверов", callback_data=CB.IPS)
+    kb.button(text="📈 Пик онлайна", callback_data=CB.ONLINE_CHART)
+    kb.adjust(2)
+    return kb.as_markup()
+
+
+def _admin_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="➕ Добавить промо", callback_data=CB.ADD_PROMO)
+    kb.button(text="➖ Удалить промо", callback_data=CB.DEL_PROMO)
+    kb.button(text="📋 Список промокодов", callback_data=CB.LIST_PROMOS)
+    kb.button(text="👥 Список пользователей", callback_data=CB.LIST_USERS)
+    kb.button(text="📊 Статистика", callback_data=CB.STATS)
+    kb.button(text="📩 Все вопросы", callback_data=CB.LIST_TICKETS)
+    kb.button(text="📢 Рассылка", callback_data=CB.BROADCAST)
+    kb.button(text="📦 Рассылки", callback_data=CB.BROADCAST_JOBS)
+    kb.button(text="⬅ Назад в меню", callback_data=CB.ADMIN_EXIT)
+    kb.adjust(2)
+    return kb.as_markup()
+
+
+def _back_kb(callback_data, text):
+    kb = InlineKeyboardBuilder()
+    kb.button(text=text, callback_data=callback_data)
+    return kb.as_markup()
+
+
+def _bc_confirm_kb():
+    kb = InlineKeyboardBuilder()
+    kb.button(text="📤 Отправить всем", callback_data=CB.BC_SEND_ALL)
+    kb.button(text="📤 Только новым игрокам", callback_data=CB.BC_SEND_NEW)
+    kb.button(text="📤 Активным за месяц", callback_data=CB.BC_SEND_ACTIVE)
+    kb.button(text="📤 С рейд-оповещениями", callback_data=CB.BC_SEND_RAID)
+    kb.button(text="❌ Отменить рассылку", callback_data=CB.BC_CANCEL)
+    kb.adjust(2)
+    return kb.as_markup()
+
+
+MAIN_KB = _main_kb()
+ADMIN_KB = _admin_kb()
+BACK_KB = _back_kb(CB.BACK_MAIN, "⬅️ Назад")
+ADMIN_BACK_KB = _back_kb(CB.ADMIN_BACK, "⬅ Назад")
+BC_CONFIRM_KB = _bc_confirm_kb()
+
+INFO_TEXT = (
+    "❓ <b>Информация о промокодах и сервере</b>\n\n"
+    "✏️ Наши соц.сети:\n"
+    "✏️ DISCORD: https://discord.gg/D6Rn6aXDhX\n"
+    "✏️ Группа ВК: https://vk.com/hostile_rust\n\n"
+    "🎁 Промокоды:\n"
+    "- Выдаются через бота\n"
+    f"- Чтобы активировать его, зайдите на сайт и авторизуйтесь через Steam: {SHOP_URL}\n\n"
+    "💣 Вайпы:\n"
+    "- Проходят каждый четверг в 12:00 МСК\n"
+    "- Первый четверг месяца в 22:00 МСК\n\n"
+    "⚠️ Правила сервера:\n"
+    "- Не использовать читы/макросы и прочие гадости\n"
+    "- Уважать других игроков\n"
+    "- Соблюдать общие правила серверов *Hostile Rust*"
+)
+
+IPS_TEXT = (
+    "📜 *IP серверов Hostile Rust*\n\n"
+    "Нажми кнопку — команда появится в поле ввода.\n"
+    "Дальше просто скопируй и вставь в консоли игры 👇"
+)
+
+
+def ips_kb(servers):
+    """Кнопки с командой connect; список серверов не меняется, собираем один раз при старте"""
+    kb = InlineKeyboardBuilder()
+    for server in servers:
+        kb.button(
+            text=f"📋 Скопировать Hostile {server.name}",
+            switch_inline_query_current_chat=f"connect {server.connect_address}"
+        )
+    kb.button(text="⬅️ Назад", callback_data=CB.BACK_MAIN)
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+# ===== WITH PARAMETERS =====
+# Одинаковые аргументы -> тот же объект из LRU
+
+@lru_cache(maxsize=MAX_VARIANTS)
+def main_text(first_name="Игрок"):
+    return (
+        f"🔥 *Приветствуем тебя, {first_name}!*\n\n"
+        "📢 Ты попал в информационного бота серверов *Hostile Rust*!\n"
+        "⬇️ Выбери действие ниже ⬇️"
+    )
+
+
+@lru_cache(maxsize=MAX_VARIANTS)
+def link_raid_text(telegram_id):
+    return (
+        "🔗 <b>Привязка рейд-уведомлений</b>\n\n"
+        "1️⃣ Зайдите на сервер Hostile Rust и введите /link\n"
+        "2️⃣ Введите ваш код в окно плагина:\n\n"
+        f"<code>{telegram_id}</code>\n\n"
+        "3️⃣ После подтверждения вы будете получать\n"
+        "уведомления о разрушении вашей базы в Telegram."
+    )
+
+
+@lru_cache(maxsize=MAX_VARIANTS)
+def delpromo_confirm_kb(promo_id):
+    kb = InlineKeyboardBuilder()
+    kb.button(text="✅ Да, удалить", callback_data=f"{CB.DELPROMO_YES}{promo_id}")
+    kb.button(text="❌ Отмена", callback_data=CB.DEL_PROMO)
+    kb.adjust(1)
+    return kb.as_markup()
+
+
+@lru_cache(maxsize=MAX_VARIANTS)
+def ticket_admin_kb(ticket_id):
+    kb = InlineKeyboardBuilder()
+    kb.button(text="✏️ Ответить", callback_data=f"{CB.TICKET_ANSWER}{ticket_id}")
+    kb.button(text="✋ Взять себе", callback_data=f"{CB.TICKET_TAKE}{ticket_id}")
+    kb.button(text="✅ Закрыть", callback_data=f"{CB.TICKET_CLOSE}{ticket_id}")
+    kb.button(text="↩️ Отпустить", callback_data=f"{CB.TICKET_RELEASE}{ticket_id}")
+    kb.adjust(1, 3)
+    return kb.as_markup()
+
+
+@lru_cache(maxsize=MAX_VARIANTS)
+def ticket_release_kb(ticket_id):
+    kb = InlineKeyboardBuilder()
+    kb.button(text="↩️ Отпустить вопрос", callback_data=f"{CB.TICKET_RELEASE}{ticket_id}")
+    return kb.as_markup()
+
+
+@lru_cache(maxsize=MAX_VARIANTS)
+def ticket_reply_kb(ticket_id):
+    kb = InlineKeyboardBuilder()
+    kb.button(text="↩️ Ответить", callback_data=f"{CB.TICKET_REPLY}{ticket_id}")
+    return kb.as_markup()
+
+
+@lru_cache(maxsize=MAX_VARIANTS)
+def job_kb(job_id, status):
+    """Кнопки управления заданием рассылки под сообщением с прогрессом (None — управлять нечем)"""
+    if status not in ("running", "paused"):
+        return None
+    kb = InlineKeyboardBuilder()
+    if status == "running":
+        kb.button(text="⏸ Пауза", callback_data=f"{CB.BCJOB}pause_{job_id}")
+    elif status == "paused":
+        kb.button(text="▶ Продолжить", callback_data=f"{CB.BCJOB}resume_{job_id}")
+    kb.button(text="✖ Отменить", callback_data=f"{CB.BCJOB}cancel_{job_id}")
+    kb.adjust(2)
+    return kb.as_markup()
@@ -0,0 +1,78 @@
+import json
+import logging
+import queue as queue_module
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+LOG_FORMAT = "%(asctime)s | %(levelname)s | %(message)s"
+MAX_BYTES = 10 * 1024 * 1024
+BACKUPS = 5
+CONTEXT_FIELDS = ("user_id", "handler", "latency")
+
+# Данные текущего апдейта (user_id, handler); выставляет MetricsMiddleware
+log_context = ContextVar("log_context", default=None)
+
+
+class ContextFilter(logging.Filter):
+    """Дописывает в запись поля текущего апдейта.
+
+    Стоит на QueueHandler, то есть срабатывает в потоке, который логирует:
+    в потоке QueueListener контекста апдейта уже нет.
+    """
+
+    def filter(self, record):
+        for key, value in (log_context.get() or {}).items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Одна запись — одна JSON-строка с полями контекста, если они есть"""
+
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        return json.dumps(data, ensure_ascii=False)
+
+
+def setup_logging(path=None, json_format=False, queue=None, level=logging.INFO):
+    """Переводит логирование на очередь.
+
+    У root остаётся только QueueHandler, а файл с ротацией и консоль пишет
+    QueueListener в своём потоке, так что диск не тормозит event loop.
+    queue — общая очередь многопроцессного режима: без path процесс только
+    кладёт в неё записи (воркер), пишет тот, кто её слушает.
+    Возвращает запущенный QueueListener или None.
+    """
+    if queue is None:
+        queue = queue_module.SimpleQueue()
+    handler = QueueHandler(queue)
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for old in root.handlers[:]:
+        root.removeHandler(old)
+    root.addHandler(handler)
+    root.setLevel(level)
+    if path is None:
+        return None
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(LOG_FORMAT)
+    file_handler = RotatingFileHandler(path, maxBytes=MAX_BYTES, backupCount=BACKUPS, encoding="utf-8")
+    stream_handler = logging.StreamHandler()
+    for h in (file_handler, stream_handler):
+        h.setFormatter(formatter)
+
+    listener = QueueListener(queue, file_handler, stream_handler, respect_handler_level=True)
+    listener.start()
+    return listener
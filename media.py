@@ -0,0 +1,75 @@
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+log = logging.getLogger("bot")
+
+# Ошибки Telegram, после которых file_id больше не годится; остальные (например,
+# разметка подписи) к файлу не относятся, и кэш из-за них не сбрасываем
+STALE_FILE_ERRORS = ("file identifier", "file_id", "file reference")
+
+
+def _digest(path):
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+class MediaCache:
+    """file_id статических медиа (картинка /start и т.п.).
+
+    Файл загружается в Telegram один раз, полученный file_id хранится в БД
+    и дальше отправляется вместо файла. Источник — локальный файл, а если
+    его нет — запасной URL. Поменялся файл (другой sha256) или Telegram
+    отверг file_id — загружаем заново.
+    """
+
+    def __init__(self, bot, db):
+        self.bot = bot
+        self.db = db
+        self._ids = {}  # key -> (digest, file_id)
+        self._digests = {}  # path -> sha256, считаем один раз за процесс
+
+    async def send(self, kind, chat_id, path, fallback_url=None, **kwargs):
+        """bot.send_<kind>(chat_id, ...) с кэшированным file_id. kind: photo, document, video, animation"""
+        path = Path(path)
+        if path.exists():
+            key = str(path)
+            if key not in self._digests:
+                self._digests[key] = await asyncio.to_thread(_digest, path)
+            digest, source = self._digests[key], FSInputFile(path)
+        elif fallback_url:
+            key = digest = fallback_url
+            source = fallback_url
+        else:
+            raise FileNotFoundError(path)
+
+        send = getattr(self.bot, f"send_{kind}")
+        file_id = await self._get(key, digest)
+        if file_id:
+            try:
+                return await send(chat_id, file_id, **kwargs)
+            except TelegramBadRequest as e:
+                if not any(error in e.message.lower() for error in STALE_FILE_ERRORS):
+                    raise
+                log.warning(f"MEDIA {key} file_id rejected, re-uploading -> {e}")
+                self._ids.pop(key, None)
+                await self.db.delete_media(key)
+
+        message = await send(chat_id, source, **kwargs)
+        media = getattr(message, kind)
+        file_id = (media[-1] if kind == "photo" else media).file_id  # фото приходит в нескольких размерах
+        self._ids[key] = (digest, file_id)
+        await self.db.set_media(key, digest, file_id)
+        log.info(f"MEDIA {key} uploaded")
+        return message
+
+    async def _get(self, key, digest):
+        if key not in self._ids:
+            row = await self.db.get_media(key)
+            if row:
+                self._ids[key] = row
+        cached = self._ids.get(key)
+        return cached[1] if cached and cached[0] == digest else None
@@ -0,0 +1,190 @@
+import asyncio
+import bisect
+import functools
+import inspect
+import logging
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+log = logging.getLogger("bot")
+
+# Границы корзин гистограмм в секундах
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+LAG_INTERVAL = 0.5  # как часто меряем задержку event loop
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Metric:
+    """Метрика в формате Prometheus; значения по набору меток хранятся в памяти процесса"""
+
+    kind = "untyped"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values = {}
+        REGISTRY.append(self)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, value in self._values.items():
+            yield f"{self.name}{_labels(self.labelnames, labels)} {value}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, value=1):
+        self._values[labels] = self._values.get(labels, 0) + value
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        entry = self._values.get(labels)
+        if entry is None:
+            # [попадания по корзинам (последняя — +Inf), сумма]
+            entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def render(self):
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', bound)])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {total}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}"
+
+
+def render():
+    return "\n".join(line for metric in REGISTRY for line in metric.render()) + "\n"
+
+
+# ===== METRICS =====
+HANDLER_LATENCY = Histogram("bot_handler_seconds", "Время работы обработчиков", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Исключения в обработчиках", ["handler"])
+DB_LATENCY = Histogram("bot_db_seconds", "Время методов Database", ["method"])
+DB_ERRORS = Counter("bot_db_errors_total", "Ошибки методов Database", ["method"])
+A2S_LATENCY = Histogram("bot_a2s_seconds", "Время A2S-запросов к серверам", ["query"])
+A2S_ERRORS = Counter("bot_a2s_errors_total", "Неудачные A2S-запросы", ["query"])
+TELEGRAM_CALLS = Counter("bot_telegram_calls_total", "Вызовы Bot API", ["method", "result"])
+TELEGRAM_LATENCY = Histogram("bot_telegram_seconds", "Время вызовов Bot API", ["method"])
+BROADCAST_MESSAGES = Counter("bot_broadcast_messages_total", "Сообщения рассылок", ["result"])
+RAID_EVENTS = Counter("bot_raid_events_total", "Рейд-события от плагина", ["result"])
+RAID_MESSAGES = Counter("bot_raid_messages_total", "Рейд-оповещения игрокам", ["result"])
+LOOP_LAG = Histogram(
+    "bot_event_loop_lag_seconds", "Задержка event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1),
+)
+
+
+def timed(histogram, errors=None):
+    """Декоратор корутины: время в histogram, исключения в errors, метка — имя функции"""
+    def decorator(func):
+        name = func.__name__
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                if errors is not None:
+                    errors.inc(name)
+                raise
+            finally:
+                histogram.observe(time.perf_counter() - start, name)
+        return wrapper
+    return decorator
+
+
+def instrument(histogram, errors=None, exclude=()):
+    """Декоратор класса: timed для всех публичных корутин, кроме exclude"""
+    def decorator(cls):
+        for name, func in list(vars(cls).items()):
+            if not name.startswith("_") and name not in exclude and inspect.iscoroutinefunction(func):
+                setattr(cls, name, timed(histogram, errors)(func))
+        return cls
+    return decorator
+
+
+class MetricsServer:
+    """Локальный HTTP-эндпоинт /metrics и замер задержки event loop"""
+
+    def __init__(self, host="127.0.0.1", port=9101):
+        self.host = host
+        self.port = int(port)
+        self._runner = None
+        self._lag_task = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        self._lag_task = asyncio.create_task(self._watch_lag())
+        log.info(f"METRICS listening on {self.host}:{self.port}/metrics")
+
+    async def handle(self, request):
+        return web.Response(
+            body=render().encode(),
+            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+        )
+
+    async def _watch_lag(self):
+        # Если loop занят синхронной работой, sleep проснётся позже запрошенного
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(LAG_INTERVAL)
+            LOOP_LAG.observe(max(loop.time() - start - LAG_INTERVAL, 0))
+
+    async def close(self):
+        if self._lag_task is not None:
+            self._lag_task.cancel()
+            await asyncio.gather(self._lag_task, return_exceptions=True)
+            self._lag_task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
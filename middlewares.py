@@ -0,0 +1,146 @@
+import logging
+import time
+from collections import Counter
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import CallbackQuery
+
+from logs import log_context
+from metrics import HANDLER_ERRORS, HANDLER_LATENCY, TELEGRAM_CALLS, TELEGRAM_LATENCY
+
+log = logging.getLogger("bot")
+
+# Ведро токенов на пользователя: до BURST действий подряд, дальше RATE в секунду
+BURST = 8
+RATE = 1.0
+MAX_BUCKETS = 50000
+
+# Вес обработчика = сколько токенов он стоит (ходит в БД, A2S или правит сообщения)
+SLOW_HANDLER = 1.0  # секунды; обработчики дольше пишутся в лог с latency
+
+HANDLER_COSTS = {
+    "promo": 3,
+    "history": 2,
+    "servers": 2,
+    "online_chart": 2,
+    "start": 2,
+}
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    """Анти-флуд для апдейтов пользователей.
+
+    Вешается как inner middleware, поэтому знает, какой обработчик сработал,
+    и списывает его вес. Если токенов не хватает, обработчик не вызывается,
+    а колбэк получает дешёвый cb.answer.
+    """
+
+    def __init__(self, burst=BURST, rate=RATE, costs=None, exempt=()):
+        self.burst = burst
+        self.rate = rate
+        self.costs = HANDLER_COSTS if costs is None else costs
+        self.exempt = set(exempt)
+        self._buckets = {}  # user_id -> [токены, время последнего пополнения]
+        self.passed = Counter()
+        self.dropped = Counter()
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        name = data["handler"].callback.__name__
+        if user is None or user.id in self.exempt:
+            return await handler(event, data)
+
+        if not self._take(user.id, self.costs.get(name, 1)):
+            self.dropped[name] += 1
+            if isinstance(event, CallbackQuery):
+                await event.answer("⏳ Слишком часто, подождите пару секунд")
+            return None
+
+        self.passed[name] += 1
+        return await handler(event, data)
+
+    def _take(self, user_id, cost):
+        now = time.monotonic()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_BUCKETS:
+                self._cleanup(now)
+            bucket = self._buckets[user_id] = [float(self.burst), now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < cost:
+            bucket[0] = tokens
+            return False
+        bucket[0] = tokens - cost
+        return True
+
+    def _cleanup(self, now):
+        # Полностью восстановившиеся вёдра ничем не отличаются от новых — их можно забыть
+        full = self.burst / self.rate
+        self._buckets = {u: b for u, b in self._buckets.items() if now - b[1] < full}
+
+    def stats(self):
+        return {"passed": sum(self.passed.values()), "dropped": dict(self.dropped)}
+
+
+class MetricsMiddleware(BaseMiddleware):
+    """Время и ошибки обработчиков по имени (inner middleware, как ThrottlingMiddleware).
+
+    Заодно выставляет контекст лога: все записи внутри обработчика получают
+    user_id и handler (см. logs.py).
+    """
+
+    async def __call__(self, handler, event, data):
+        name = data["handler"].callback.__name__
+        user = data.get("event_from_user")
+        token = log_context.set({"user_id": user.id if user else None, "handler": name})
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            HANDLER_LATENCY.observe(latency, name)
+            if latency > SLOW_HANDLER:
+                log.warning(f"SLOW HANDLER {name} -> {latency:.2f}s", extra={"latency": round(latency, 3)})
+            log_context.reset(token)
+
+
+class ActivityMiddleware(BaseMiddleware):
+    """Отмечает, что пользователь заходил в бота (сегмент "active" у рассылок).
+
+    Запись write-behind (Database.touch_user), так что апдейт не ждёт БД.
+    """
+
+    def __init__(self, db):
+        self.db = db
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is not None:
+            await self.db.touch_user(user.id)
+        return await handler(event, data)
+
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Счётчики вызовов Bot API: ok / retry_after (429) / error по методу"""
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        start = time.perf_counter()
+        try:
+            response = await make_request(bot, method)
+        except TelegramRetryAfter:
+            TELEGRAM_CALLS.inc(name, "retry_after")
+            raise
+        except Exception:
+            TELEGRAM_CALLS.inc(name, "error")
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - start, name)
+        TELEGRAM_CALLS.inc(name, "ok")
+        return response
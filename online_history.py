@@ -0,0 +1,50 @@
+import time
+
+# Сколько дней хранить каждый уровень истории онлайна
+RAW_DAYS = 3
+HOURLY_DAYS = 90
+DAILY_DAYS = 3 * 365
+
+SPARK = "▁▂▃▄▅▆▇█"
+
+
+def sparkline(values):
+    """Мини-график из блочных символов; None — пропуск в данных"""
+    top = max((v for v in values if v is not None), default=0) or 1
+    return "".join(
+        " " if v is None else SPARK[min(int(v / top * (len(SPARK) - 1) + 0.5), len(SPARK) - 1)]
+        for v in values
+    )
+
+
+def fill_buckets(rows, start, step, count):
+    """Раскладывает (bucket, peak) по равным интервалам, пустые — None"""
+    peaks = {bucket: peak for bucket, peak in rows}
+    return [peaks.get(start + i * step) for i in range(count)]
+
+
+async def online_report(db, server, utc_offset):
+    """Текст с пиками и графиками онлайна сервера за сутки и за неделю"""
+    now = int(time.time())
+    hour_start = now // 3600 * 3600 - 23 * 3600
+    day_start = (now + utc_offset) // 86400 * 86400 - utc_offset - 6 * 86400
+
+    hours = await db.get_online_rollups(server.name, "hour", hour_start)
+    days = await db.get_online_rollups(server.name, "day", day_start)
+
+    hourly = fill_buckets([(r[0], r[2]) for r in hours], hour_start, 3600, 24)
+    # Сегодняшний день ещё не свёрнут в дневной агрегат — берём его из часовых
+    today = day_start + 6 * 86400
+    today_peak = max((r[2] for r in hours if r[0] >= today), default=None)
+    daily = fill_buckets([(r[0], r[2]) for r in days], day_start, 86400, 7)
+    daily[-1] = today_peak
+
+    peak_day = max((v for v in hourly if v is not None), default=0)
+    peak_week = max((v for v in daily if v is not None), default=0)
+
+    return (
+        f"🖥 *{server.name}*\n"
+        f"🔥 Пик за сутки: {peak_day} | за неделю: {peak_week}\n"
+        f"`24ч {sparkline(hourly)}`\n"
+        f"`7д  {sparkline(daily)}`"
+    )
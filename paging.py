@@ -0,0 +1,36 @@
+from aiogram.types import InlineKeyboardButton
+
+PAGE_SIZE = 10
+
+# callback_data кнопок листания: pg_<список>_<n|p>_<номер страницы>_<ключ>
+# n — строки после ключа (вперёд), p — перед ключом (назад)
+PREFIX = "pg_"
+NOOP = "pg_noop"
+
+
+def page_count(total, size=PAGE_SIZE):
+    return max((total + size - 1) // size, 1)
+
+
+def pager_row(kb, name, page, pages, first_key, last_key):
+    """Добавляет в клавиатуру ряд "◀ 1/57 ▶".
+
+    Страница задаётся ключом первой/последней строки, а не смещением, поэтому
+    запрос следующей стоит одинаково на любой странице.
+    """
+    buttons = []
+    if page > 1:
+        buttons.append(InlineKeyboardButton(text="◀", callback_data=f"{PREFIX}{name}_p_{page - 1}_{first_key}"))
+    buttons.append(InlineKeyboardButton(text=f"{page}/{pages}", callback_data=NOOP))
+    if page < pages:
+        buttons.append(InlineKeyboardButton(text="▶", callback_data=f"{PREFIX}{name}_n_{page + 1}_{last_key}"))
+    kb.row(*buttons)
+
+
+def parse_pager(data):
+    """callback_data -> (список, номер страницы, after, before)"""
+    name, direction, page, key = data[len(PREFIX):].split("_")
+    key = int(key)
+    if direction == "n":
+        return name, int(page), key, None
+    return name, int(page), None, key
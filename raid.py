@@ -0,0 +1,270 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+from collections import OrderedDict
+from html import escape
+
+from aiogram.exceptions import TelegramForbiddenError, TelegramRetryAfter
+from aiohttp import web
+
+from broadcast import RateLimiter
+from metrics import RAID_EVENTS, RAID_MESSAGES
+
+log = logging.getLogger("bot")
+
+SECRET_HEADER = "X-Raid-Secret"
+RAID_RATE = 25  # общий лимит сообщений в секунду (отдельный от рассылок: рейд важнее)
+WORKERS = 16
+DEDUP_WINDOW = 60  # секунды: то же событие (игрок, сервер, грид, рейдер) повторно не шлём
+MAX_EVENTS = 5  # событий в одном сообщении; остальные — "и ещё N"
+MAX_USERS = 10000  # сколько игроков может ждать доставки; сверх этого новые события отбрасываем
+MAX_ATTEMPTS = 3
+DRAIN_TIMEOUT = 5  # секунды на дорассылку при остановке: старое оповещение о рейде уже не нужно
+
+
+class RaidConfig:
+    """Настройки приёма событий от плагина на сервере Rust (RAID_PORT / RAID_UDP_PORT включают)"""
+
+    def __init__(self, host="127.0.0.1", port=0, udp_port=0, secret=None):
+        self.host = host
+        self.port = int(port)
+        self.udp_port = int(udp_port)
+        self.secret = secret
+
+    @property
+    def enabled(self):
+        return bool(self.port or self.udp_port)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            host=os.getenv("RAID_HOST", "127.0.0.1"),
+            port=os.getenv("RAID_PORT", 0),
+            udp_port=os.getenv("RAID_UDP_PORT", 0),
+            secret=os.getenv("RAID_SECRET"),
+        )
+
+
+def _parse(payload):
+    """Событие плагина -> (kind, telegram_id, server, grid, attacker) или None, если оно битое.
+
+    Рейд: {"telegram_id": 1, "grid": "G12", "attacker": "Ник", "server": "Main"}
+    Привязка после /link: {"type": "link", "telegram_id": 1}
+    """
+    if not isinstance(payload, dict):
+        return None
+    try:
+        telegram_id = int(payload["telegram_id"])
+    except (KeyError, TypeError, ValueError):
+        return None
+    kind = payload.get("type", "raid")
+    if kind == "link":
+        return "link", telegram_id, None, None, None
+    if kind != "raid" or not payload.get("grid"):
+        return None
+    server = str(payload.get("server") or "")
+    return "raid", telegram_id, server, str(payload["grid"]), str(payload.get("attacker") or "")
+
+
+def _format(events, extra):
+    lines = []
+    for server, grid, attacker in events:
+        line = f"📍 {escape(grid)}"
+        if server:
+            line += f" ({escape(server)})"
+        if attacker:
+            line += f" — {escape(attacker)}"
+        lines.append(line)
+    if extra:
+        lines.append(f"…и ещё {extra}")
+    return "🚨 <b>Вашу базу рейдят!</b>\n\n" + "\n".join(lines)
+
+
+class _UDPProtocol(asyncio.DatagramProtocol):
+    def __init__(self, notifier):
+        self.notifier = notifier
+
+    def datagram_received(self, data, addr):
+        self.notifier.handle_datagram(data)
+
+
+class RaidNotifier:
+    """Рейд-оповещения от плагина игрокам в Telegram.
+
+    События приходят по HTTP (POST /raid, одно или списком) или UDP (одна
+    датаграмма — JSON с полем secret). Повтор того же события в течение
+    DEDUP_WINDOW отбрасывается. События одного игрока копятся в одной записи
+    (не больше MAX_EVENTS, остальное — счётчиком), а в очередь доставки игрок
+    попадает один раз: пока он ждёт, новые события дописываются в ту же
+    запись. Так при массовом рейде каждому уходит одно сообщение, а воркеры
+    шлют их с общим и поканальным лимитом.
+    """
+
+    def __init__(self, bot, db, config, limiter=None, workers=WORKERS,
+                 dedup_window=DEDUP_WINDOW, max_events=MAX_EVENTS, max_users=MAX_USERS):
+        self.bot = bot
+        self.db = db
+        self.config = config
+        self.limiter = limiter or RateLimiter(RAID_RATE)
+        self.workers = workers
+        self.dedup_window = dedup_window
+        self.max_events = max_events
+        self.max_users = max_users
+        self._seen = OrderedDict()  # (telegram_id, server, grid, attacker) -> время первого события
+        self._pending = {}  # telegram_id -> [[(server, grid, attacker)], сколько не влезло]
+        self._ready = asyncio.Queue()  # telegram_id в порядке первого события
+        self._tasks = set()  # привязки, которые пишутся в БД
+        self._workers = []
+        self._runner = None
+        self._transport = None
+
+    # ===== ПРИЁМ =====
+    def push(self, payload):
+        """Принимает одно событие. Результат: queued, merged, duplicate, dropped, linked или invalid"""
+        event = _parse(payload)
+        if event is None:
+            result = "invalid"
+        elif event[0] == "link":
+            task = asyncio.create_task(self._link(event[1]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+            result = "linked"
+        else:
+            result = self._add(event[1], event[2:])
+        RAID_EVENTS.inc(result)
+        return result
+
+    def _add(self, telegram_id, event):
+        now = asyncio.get_running_loop().time()
+        # Ключи лежат в порядке появления, так что устаревшие всегда в начале
+        while self._seen and next(iter(self._seen.values())) <= now - self.dedup_window:
+            self._seen.popitem(last=False)
+        key = (telegram_id, *event)
+        if key in self._seen:
+            return "duplicate"
+
+        entry = self._pending.get(telegram_id)
+        if entry is None:
+            if len(self._pending) >= self.max_users:
+                return "dropped"
+            entry = self._pending[telegram_id] = [[], 0]
+            self._ready.put_nowait(telegram_id)
+            result = "queued"
+        else:
+            result = "merged"
+        self._seen[key] = now
+        if len(entry[0]) < self.max_events:
+            entry[0].append(event)
+        else:
+            entry[1] += 1
+        return result
+
+    async def _link(self, telegram_id):
+        try:
+            if await self.db.set_raid_linked(telegram_id):
+                log.info(f"RAID LINKED {telegram_id}")
+                await self.bot.send_message(telegram_id, "✅ Рейд-оповещения привязаны к этому аккаунту")
+        except Exception as e:
+            log.error(f"RAID link error {telegram_id} -> {e}")
+
+    def _push_all(self, payload):
+        results = {}
+        for item in payload if isinstance(payload, list) else [payload]:
+            result = self.push(item)
+            results[result] = results.get(result, 0) + 1
+        return results
+
+    async def handle_http(self, request):
+        if self.config.secret and not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.config.secret
+        ):
+            return web.Response(status=401)
+        try:
+            payload = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+        return web.json_response(self._push_all(payload))
+
+    def handle_datagram(self, data):
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            RAID_EVENTS.inc("invalid")
+            return
+        if self.config.secret and not (
+            isinstance(payload, dict) and hmac.compare_digest(str(payload.pop("secret", "")).encode(), self.config.secret.encode())
+        ):
+            RAID_EVENTS.inc("unauthorized")
+            return
+        self._push_all(payload.get("events", payload) if isinstance(payload, dict) else payload)
+
+    # ===== ДОСТАВКА =====
+    async def _worker(self):
+        while True:
+            telegram_id = await self._ready.get()
+            try:
+                # Сначала ждём слот, потом забираем события: пока ждали, могли прийти ещё
+                await self.limiter.wait(telegram_id)
+                events, extra = self._pending.pop(telegram_id)
+                result = await self._send(telegram_id, _format(events, extra))
+                RAID_MESSAGES.inc(result)
+            except Exception as e:
+                log.error(f"RAID delivery error {telegram_id} -> {e}")
+            finally:
+                self._ready.task_done()
+
+    async def _send(self, telegram_id, text):
+        for attempt in range(MAX_ATTEMPTS):
+            if attempt:
+                await self.limiter.wait(telegram_id)
+            try:
+                await self.bot.send_message(telegram_id, text, parse_mode="HTML")
+                return "sent"
+            except TelegramRetryAfter as e:
+                log.warning(f"RAID 429 -> retry after {e.retry_after}s")
+                self.limiter.pause(e.retry_after)
+            except TelegramForbiddenError:
+                await self.db.mark_blocked(telegram_id)
+                return "blocked"
+            except Exception as e:
+                log.error(f"RAID send error {telegram_id} -> {e}")
+                return "failed"
+        return "failed"
+
+    # ===== ЗАПУСК =====
+    async def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        if self.config.port:
+            app = web.Application()
+            app.router.add_post("/raid", self.handle_http)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.config.host, self.config.port).start()
+            log.info(f"RAID listening on http://{self.config.host}:{self.config.port}/raid")
+        if self.config.udp_port:
+            loop = asyncio.get_running_loop()
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _UDPProtocol(self), local_addr=(self.config.host, self.config.udp_port)
+            )
+            log.info(f"RAID listening on udp://{self.config.host}:{self.config.udp_port}")
+
+    async def close(self):
+        """Перестаёт принимать события и недолго дорассылает уже принятые"""
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._ready.join(), DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            log.warning(f"RAID dropped {len(self._pending)} undelivered notifications on shutdown")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, *self._tasks, return_exceptions=True)
+        self._workers = []
@@ -0,0 +1,62 @@
+import asyncio
+import time
+
+STATUS_TTL = 90  # секунд; фоновый опрос обновляет кэш чаще
+POLL_INTERVAL = 30
+
+
+class StatusCache:
+    """Кэш статусов серверов в памяти.
+
+    Клик пользователя читает готовое значение, а опрос идёт в фоне.
+    Одновременные обновления одного сервера склеиваются в один запрос.
+    """
+
+    def __init__(self, fetch, ttl=STATUS_TTL):
+        self._fetch = fetch  # async fetch(ip, port) -> dict
+        self.ttl = ttl
+        self._data = {}  # (ip, port) -> (status, время получения)
+        self._inflight = {}  # (ip, port) -> asyncio.Task
+
+    def peek(self, ip, port):
+        """(status, возраст в секундах) или None, без запросов к серверу"""
+        cached = self._data.get((ip, port))
+        if cached is None:
+            return None
+        status, fetched_at = cached
+        return status, time.monotonic() - fetched_at
+
+    async def get(self, ip, port):
+        """Свежий статус из кэша, а если он устарел — дожидается обновления"""
+        cached = self.peek(ip, port)
+        if cached is not None and cached[1] < self.ttl:
+            return cached
+        await self.refresh(ip, port)
+        return self.peek(ip, port)
+
+    async def refresh(self, ip, port):
+        key = (ip, port)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key))
+            self._inflight[key] = task
+        # shield: отмена одного ждущего не должна отменять общий запрос
+        return await asyncio.shield(task)
+
+    async def refresh_all(self, addresses):
+        await asyncio.gather(*(self.refresh(ip, port) for ip, port in addresses))
+
+    async def _load(self, key):
+        try:
+            status = await self._fetch(*key)
+            self._data[key] = (status, time.monotonic())
+            return status
+        finally:
+            del self._inflight[key]
+
+
+def format_age(seconds):
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} сек назад"
+    return f"{seconds // 60} мин назад"
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+
+from storage import json_store
+
+# Значения по умолчанию: пишутся в конфиг при первом запуске
+DEFAULT_SERVERS = [
+    {
+        "name": "x5",
+        "host": "37.230.137.6",
+        "query_port": 20601,
+        "connect_port": 20600,
+        # Каждый четверг в 12:00, в первый четверг месяца — в 22:00
+        "wipe": {"weekday": 3, "hour": 12, "first_week_hour": 22},
+    },
+    {
+        "name": "x100",
+        "host": "46.174.50.248",
+        "query_port": 20641,
+        "connect_port": 20640,
+        "wipe": {"weekday": 3, "hour": 12, "first_week_hour": 22},
+    },
+]
+
+
+class Server:
+    def __init__(self, name, host, query_port, connect_port, wipe=None):
+        self.name = name
+        self.host = host
+        self.query_port = int(query_port)
+        self.connect_port = int(connect_port)
+        self.wipe = wipe or {}
+
+    @property
+    def query_address(self):
+        return self.host, self.query_port
+
+    @property
+    def connect_address(self):
+        return f"{self.host}:{self.connect_port}"
+
+    def next_wipe(self, tz, now=None):
+        """Ближайший вайп после now (или None, если расписания нет)"""
+        if "weekday" not in self.wipe:
+            return None
+        now = now or datetime.now(tz)
+        for i in range(14):
+            d = now + timedelta(days=i)
+            if d.weekday() == self.wipe["weekday"]:
+                hour = self.wipe["hour"]
+                if d.day <= 7:
+                    hour = self.wipe.get("first_week_hour", hour)
+                wipe = tz.localize(datetime(d.year, d.month, d.day, hour, self.wipe.get("minute", 0)))
+                if wipe > now:
+                    return wipe
+
+
+class ServerRegistry:
+    """Список серверов проекта из конфига. Порядок = порядок вывода в боте"""
+
+    def __init__(self, servers):
+        self.servers = list(servers)
+        self._by_name = {s.name: s for s in self.servers}
+
+    @classmethod
+    def load(cls, path):
+        store = json_store(path, DEFAULT_SERVERS)
+        if not store.exists():
+            store.save_now(DEFAULT_SERVERS)
+        return cls(Server(**item) for item in store.get())
+
+    def __iter__(self):
+        return iter(self.servers)
+
+    def __len__(self):
+        return len(self.servers)
+
+    def get(self, name):
+        return self._by_name.get(name)
+
+    def query_addresses(self):
+        return [s.query_address for s in self.servers]
+
+    def next_wipes(self, tz, now=None):
+        """{время вайпа: [серверы]} — серверы с одинаковым временем идут одной рассылкой"""
+        wipes = {}
+        for server in self.servers:
+            wipe = server.next_wipe(tz, now)
+            if wipe is not None:
+                wipes.setdefault(wipe, []).append(server)
+        return dict(sorted(wipes.items()))
@@ -0,0 +1,52 @@
+import time
+
+from cooldown import format_wait
+from online_history import fill_buckets, sparkline
+
+TREND_DAYS = 14
+TOP_USERS = 5
+
+
+async def stats_report(db, days=TREND_DAYS, top=TOP_USERS):
+    """Текст дашборда админки.
+
+    Всё читается из счётчиков, которые ведут триггеры БД (миграция 10),
+    поэтому стоимость не растёт вместе с историей. Дни — по UTC.
+    """
+    counters = await db.get_counters()
+    today = int(time.time()) // 86400 * 86400
+    start = today - (days - 1) * 86400
+
+    rows = {}
+    for name, day, value in await db.get_daily_stats(start):
+        rows.setdefault(name, []).append((day, value))
+
+    def series(name):
+        return [v or 0 for v in fill_buckets(rows.get(name, []), start, 86400, days)]
+
+    joins, promos, answered, response = (series(n) for n in ("joins", "promos", "answered", "response_seconds"))
+
+    def avg_response(last):
+        count = sum(answered[-last:])
+        return format_wait(sum(response[-last:]) / count) if count else "—"
+
+    top_users = await db.get_top_users(top)
+    top_text = "\n".join(
+        f"{place}. {name} (@{username}) — {count}"
+        for place, (name, username, count) in enumerate(top_users, start=1)
+    ) or "Нет"
+
+    return (
+        f"📊 Статистика бота:\n\n"
+        f"👥 Подписано всего пользователей: {counters.get('users', 0)} "
+        f"(+{joins[-1]} сегодня, +{sum(joins)} за {days} дн.)\n"
+        f"🎁 Всего выдано промокодов: {counters.get('promos', 0)} "
+        f"(+{promos[-1]} сегодня, +{sum(promos)} за {days} дн.)\n"
+        f"📩 Вопросы: открыто {counters.get('tickets_open', 0)}, закрыто {counters.get('tickets_closed', 0)}\n"
+        f"⏱ Среднее время ответа: 7 дн. — {avg_response(7)}, {days} дн. — {avg_response(days)}\n\n"
+        f"📈 За {days} дн.:\n"
+        f"Новые игроки  {sparkline(joins)}\n"
+        f"Промокоды     {sparkline(promos)}\n"
+        f"Ответы        {sparkline(answered)}\n\n"
+        f"🏆 Самые активные игроки:\n{top_text}"
+    )
@@ -0,0 +1,94 @@
+import copy
+import json
+import logging
+import os
+import tempfile
+import time
+from pathlib import Path
+
+log = logging.getLogger("bot")
+
+
+def write_atomic(path, data):
+    """Пишет JSON во временный файл рядом, fsync и rename поверх старого.
+
+    Падение посреди записи оставляет либо старый файл, либо новый, но не огрызок.
+    """
+    path = Path(path)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    # fsync каталога, чтобы сам rename пережил падение питания
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(path.parent, os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class JsonStore:
+    """JSON-файл, закэшированный в памяти.
+
+    Чтение отдаёт кэш и перечитывает файл, только если у него сменился
+    mtime (например, его поправили руками). Запись — save_now(), атомарно.
+    Данные из get() менять на месте нельзя.
+    """
+
+    def __init__(self, path, default):
+        self.path = Path(path)
+        self.default = default
+        self._data = None
+        self._mtime = None
+
+    def exists(self):
+        return self.path.exists()
+
+    def get(self):
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return copy.deepcopy(self.default)
+        if mtime != self._mtime:
+            self._data = self._read()
+            self._mtime = mtime
+        return self._data
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            # Битый файл не глотаем молча: откладываем его в сторону и громко пишем в лог
+            broken = self.path.with_name(f"{self.path.name}.broken-{int(time.time())}")
+            log.error(f"STORAGE corrupted {self.path} -> {e}, moved to {broken}")
+            try:
+                self.path.replace(broken)
+            except OSError:
+                pass
+            return copy.deepcopy(self.default)
+
+    def save_now(self, data):
+        """Синхронная запись для старта, когда event loop ещё не запущен"""
+        write_atomic(self.path, data)
+        self._data = data
+        self._mtime = self.path.stat().st_mtime_ns
+
+
+_stores = {}
+
+
+def json_store(path, default):
+    """Общий JsonStore на файл, чтобы все обработчики делили один кэш"""
+    path = Path(path).resolve()
+    if path not in _stores:
+        _stores[path] = JsonStore(path, default)
+    return _stores[path]
+
@@ -0,0 +1,103 @@
+import asyncio
+import os
+import unittest
+from unittest import mock
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from webhook import SECRET_HEADER, WebhookConfig, WebhookServer
+
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        "text": "/start",
+    },
+}
+
+
+class FakeDispatcher:
+    """Вместо aiogram: запоминает апдейты и держит их, пока не отпустят release"""
+
+    def __init__(self):
+        self.updates = []
+        self.release = asyncio.Event()
+        self.fail = False
+
+    async def feed_update(self, bot, update):
+        self.updates.append(update)
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("handler failed")
+
+
+class WebhookServerTest(unittest.IsolatedAsyncioTestCase):
+    """Telegram изображает тестовый клиент: шлёт апдейты POST-запросами"""
+
+    async def asyncSetUp(self):
+        self.dp = FakeDispatcher()
+        self.server = WebhookServer(self.dp, None, WebhookConfig("https://example.org", secret="s3cret"))
+        self.client = TestClient(TestServer(self.server.app))
+        await self.client.start_server()
+
+    async def asyncTearDown(self):
+        self.dp.release.set()
+        await self.client.close()
+
+    async def post(self, secret=None):
+        headers = {SECRET_HEADER: secret} if secret is not None else {}
+        return await self.client.post("/webhook", json=UPDATE, headers=headers)
+
+    async def test_rejects_without_secret(self):
+        self.assertEqual((await self.post()).status, 401)
+        self.assertEqual((await self.post("wrong")).status, 401)
+        self.assertEqual(self.dp.updates, [])
+
+    async def test_accepts_before_handler_finishes(self):
+        response = await self.post("s3cret")
+        self.assertEqual(response.status, 200)
+        await asyncio.sleep(0)
+        self.assertEqual([u.update_id for u in self.dp.updates], [1])
+        self.assertEqual(len(self.server._tasks), 1)
+
+    async def test_handler_error_is_logged_with_update_id(self):
+        self.dp.fail = True
+        self.dp.release.set()
+        with self.assertLogs("bot", "ERROR") as logs:
+            await self.post("s3cret")
+            await self.server.drain()
+        self.assertIn("UPDATE 1 failed -> RuntimeError: handler failed", logs.output[0])
+
+    async def test_drain_waits_for_inflight_and_then_refuses(self):
+        await self.post("s3cret")
+        drain = asyncio.create_task(self.server.drain())
+        await asyncio.sleep(0.05)
+        self.assertFalse(drain.done())
+        self.assertEqual((await self.post("s3cret")).status, 503)
+
+        self.dp.release.set()
+        await asyncio.wait_for(drain, 1)
+        self.assertEqual(len(self.server._tasks), 0)
+        self.assertEqual(len(self.dp.updates), 1)
+        health = await (await self.client.get("/health")).json()
+        self.assertEqual(health, {"status": "closing", "inflight": 0})
+
+
+class WebhookConfigTest(unittest.TestCase):
+    def test_secret_is_required(self):
+        env = {"WEBHOOK_URL": "https://example.org"}
+        with mock.patch.dict(os.environ, env, clear=True):
+            with self.assertRaises(KeyError):
+                WebhookConfig.from_env()
+        with mock.patch.dict(os.environ, {**env, "WEBHOOK_SECRET": ""}, clear=True):
+            with self.assertRaises(ValueError):
+                WebhookConfig.from_env()
+        with mock.patch.dict(os.environ, {**env, "WEBHOOK_SECRET": "s3cret"}, clear=True):
+            self.assertEqual(WebhookConfig.from_env().secret, "s3cret")
+
+
+if __name__ == "__main__":
+    unittest.main()
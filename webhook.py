@@ -0,0 +1,122 @@
+import asyncio
+import hmac
+import logging
+import os
+import signal
+
+from aiogram.types import Update
+from aiohttp import web
+
+log = logging.getLogger("bot")
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+DRAIN_TIMEOUT = 30  # секунды на завершение начатых обработчиков при остановке
+
+
+async def process_update(feed, bot, update):
+    """feed(bot, update) для фоновой задачи: ошибку пишем в лог с id апдейта,
+    как это делает polling aiogram, а не оставляем asyncio без контекста"""
+    try:
+        await feed(bot, update)
+    except Exception as e:
+        log.exception(f"UPDATE {update.update_id} failed -> {type(e).__name__}: {e}")
+
+
+class WebhookConfig:
+    """Настройки вебхука из окружения (BOT_MODE=webhook включает режим).
+
+    Секрет обязателен: эндпоинт публичный, и без проверки заголовка любой
+    может прислать апдейт от имени админа.
+    """
+
+    def __init__(self, url, secret, path="/webhook", host="0.0.0.0", port=8080):
+        if not secret:
+            raise ValueError("WEBHOOK_SECRET is required in webhook mode")
+        self.url = url.rstrip("/")
+        self.path = path
+        self.secret = secret
+        self.host = host
+        self.port = int(port)
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            url=os.environ["WEBHOOK_URL"],
+            secret=os.environ["WEBHOOK_SECRET"],
+            path=os.getenv("WEBHOOK_PATH", "/webhook"),
+            host=os.getenv("WEBHOOK_HOST", "0.0.0.0"),
+            port=os.getenv("WEBHOOK_PORT", 8080),
+        )
+
+
+class WebhookServer:
+    """aiohttp-сервер для апдейтов Telegram.
+
+    Апдейт подтверждается сразу, а обрабатывается фоновой задачей, чтобы
+    Telegram не ждал медленных обработчиков. При остановке новые апдейты
+    не принимаются, а начатые дорабатывают до DRAIN_TIMEOUT.
+    """
+
+    def __init__(self, dp, bot, config, feed=None):
+        self.dp = dp
+        self.bot = bot
+        self.config = config
+        # feed(bot, update): по умолчанию обрабатываем сами, в многопроцессном режиме — отдаём воркерам
+        self.feed = feed or dp.feed_update
+        self._tasks = set()
+        self._closing = False
+        self.app = web.Application()
+        self.app.router.add_post(config.path, self.handle_update)
+        self.app.router.add_get("/health", self.health)
+
+    async def handle_update(self, request):
+        if not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.config.secret
+        ):
+            return web.Response(status=401)
+        if self._closing:
+            # Telegram повторит апдейт позже — его заберёт следующий запуск
+            return web.Response(status=503)
+
+        update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        task = asyncio.create_task(process_update(self.feed, self.bot, update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def health(self, request):
+        return web.json_response({"status": "closing" if self._closing else "ok", "inflight": len(self._tasks)})
+
+    async def drain(self):
+        self._closing = True
+        if self._tasks:
+            log.info(f"WEBHOOK draining {len(self._tasks)} updates")
+            await asyncio.wait(self._tasks, timeout=DRAIN_TIMEOUT)
+
+    async def run(self):
+        """Поднимает сервер, регистрирует вебхук и работает до SIGINT/SIGTERM"""
+        runner = web.AppRunner(self.app)
+        await runner.setup()
+        site = web.TCPSite(runner, self.config.host, self.config.port)
+        await site.start()
+        await self.bot.set_webhook(
+            self.config.url + self.config.path,
+            secret_token=self.config.secret,
+            allowed_updates=self.dp.resolve_used_update_types(),
+        )
+        log.info(f"WEBHOOK listening on {self.config.host}:{self.config.port}{self.config.path}")
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop.set)
+            except NotImplementedError:  # Windows
+                pass
+        try:
+            await stop.wait()
+        finally:
+            await self.drain()
+            await runner.cleanup()
+            await self.bot.session.close()
+            log.info("WEBHOOK stopped")
@@ -0,0 +1,178 @@
+import asyncio
+import functools
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+
+from aiogram.types import Update
+
+from webhook import process_update
+
+log = logging.getLogger("bot")
+
+LEASE_TTL = 30  # секунды; лидер продлевает аренду каждые LEASE_RENEW
+LEASE_RENEW = 10
+QUEUE_SIZE = 10000
+POLL_TIMEOUT = 30
+
+
+class Leader:
+    """Выбор одного воркера под фоновые задачи через аренду в БД.
+
+    Лидер продлевает аренду каждые LEASE_RENEW секунд; если он умер, через
+    LEASE_TTL её забирает другой воркер. С enabled=False (один процесс)
+    процесс всегда лидер и в БД не ходит.
+    """
+
+    def __init__(self, db, name="scheduler", enabled=True, ttl=LEASE_TTL):
+        self.db = db
+        self.name = name
+        self.enabled = enabled
+        self.ttl = ttl
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = not enabled
+
+    async def renew(self):
+        if not self.enabled:
+            return
+        was_leader = self.is_leader
+        try:
+            self.is_leader = await self.db.acquire_lease(self.name, self.owner, self.ttl)
+        except Exception as e:
+            log.error(f"LEASE {self.name} error -> {e}")
+            self.is_leader = False
+        if self.is_leader != was_leader:
+            log.info(f"LEASE {self.name} -> {'acquired' if self.is_leader else 'lost'} by {self.owner}")
+
+    async def release(self):
+        if self.enabled and self.is_leader:
+            await self.db.release_lease(self.name, self.owner)
+            self.is_leader = False
+
+    def only(self, func):
+        """Декоратор для задач планировщика: выполняются только у лидера"""
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if self.is_leader:
+                return await func(*args, **kwargs)
+        return wrapper
+
+
+def partition(update, workers):
+    """Номер воркера для апдейта: все апдейты одного пользователя идут в один процесс.
+
+    Тогда FSM, кулдауны и анти-флуд в памяти воркера остаются верными.
+    """
+    event = update.event
+    user = getattr(event, "from_user", None)
+    chat = getattr(event, "chat", None) or getattr(getattr(event, "message", None), "chat", None)
+    key = user.id if user else chat.id if chat else update.update_id
+    return key % workers
+
+
+class Supervisor:
+    """Приёмник апдейтов для многопроцессного режима.
+
+    Сам апдейты не обрабатывает: получает их (long polling или вебхук) и
+    раскладывает по очередям воркеров по id пользователя. Воркеры — отдельные
+    процессы со своим event loop, так что нагрузка ложится на несколько ядер.
+    """
+
+    def __init__(self, bot, dp, workers, target, args=()):
+        self.bot = bot
+        self.dp = dp
+        self.workers = workers
+        ctx = multiprocessing.get_context("spawn")
+        self.queues = [ctx.Queue(maxsize=QUEUE_SIZE) for _ in range(workers)]
+        self.processes = [
+            ctx.Process(target=target, args=(index, queue, *args), name=f"bot-worker-{index}")
+            for index, queue in enumerate(self.queues)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        log.info(f"SUPERVISOR started {self.workers} workers")
+
+    async def feed(self, bot, update):
+        """Совместим с dp.feed_update, чтобы его можно было отдать WebhookServer"""
+        queue = self.queues[partition(update, self.workers)]
+        data = update.model_dump_json(exclude_unset=True)
+        # put блокируется только при переполненной очереди — тогда не держим event loop
+        await asyncio.get_running_loop().run_in_executor(None, queue.put, data)
+
+    async def poll(self):
+        """Long polling с раздачей апдейтов воркерам.
+
+        По SIGTERM штатно возвращается, чтобы вызывающий дошёл до stop():
+        иначе воркеры так и висят на очереди, держа аренду и задания.
+        """
+        task = asyncio.current_task()
+        loop = asyncio.get_running_loop()
+        terminated = False
+
+        def on_sigterm():
+            nonlocal terminated
+            terminated = True
+            task.cancel()
+
+        try:
+            loop.add_signal_handler(signal.SIGTERM, on_sigterm)
+        except NotImplementedError:  # Windows
+            pass
+        try:
+            await self._poll()
+        except asyncio.CancelledError:
+            if not terminated:
+                raise
+            task.uncancel()
+            log.info("SUPERVISOR got SIGTERM")
+        finally:
+            try:
+                loop.remove_signal_handler(signal.SIGTERM)
+            except NotImplementedError:
+                pass
+
+    async def _poll(self):
+        offset = None
+        allowed = self.dp.resolve_used_update_types()
+        # После запуска в режиме webhook Telegram не отдаёт getUpdates, пока вебхук не снят
+        await self.bot.delete_webhook()
+        while True:
+            try:
+                updates = await self.bot.get_updates(offset=offset, timeout=POLL_TIMEOUT, allowed_updates=allowed)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.error(f"SUPERVISOR polling error -> {e}")
+                await asyncio.sleep(5)
+                continue
+            for update in updates:
+                await self.feed(self.bot, update)
+                offset = update.update_id + 1
+
+    async def stop(self):
+        for queue in self.queues:
+            queue.put(None)
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(None, p.join) for p in self.processes))
+        await self.bot.session.close()
+        log.info("SUPERVISOR stopped")
+
+
+async def consume(queue, bot, dp):
+    """Цикл воркера: берёт апдейты из очереди супервизора и обрабатывает их"""
+    loop = asyncio.get_running_loop()
+    tasks = set()
+    while True:
+        data = await loop.run_in_executor(None, queue.get)
+        if data is None:
+            break
+        update = Update.model_validate_json(data, context={"bot": bot})
+        task = asyncio.create_task(process_update(dp.feed_update, bot, update))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.wait(tasks)